@@ -0,0 +1,57 @@
+# miko - Benchmark of autoescape
+
+from __future__ import annotations
+
+from timeit import timeit
+import argparse
+
+from miko import Template
+from miko.builtins import _escape_value
+
+
+TEMPLATE = "".join(
+    f"<td class=\"cell\">^^ {name} ^^</td>\n"
+    for name in ("title", "count", "author", "body") * 10
+)
+CONTEXT = {
+    "title": "A plain title", "count": 12345,
+    "author": "tasuren", "body": "Tom & Jerry <3"
+}
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare rendering with autoescape and without it."
+    )
+    parser.add_argument("-n", "--number", type=int, default=20000, help="The number of the renderings.")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="How many times to measure.")
+    args = parser.parse_args(argv)
+
+    plain = Template(TEMPLATE, path="benchmark-plain.html")
+    escaped = Template(TEMPLATE, path="benchmark-escaped.html", autoescape=True)
+    assert "&amp;" in escaped.render(**CONTEXT)
+
+    # 環境による揺れを減らすため、交互に測って最小値を使う。
+    results = dict.fromkeys((
+        "str() safe", "escape safe", "str() unsafe", "escape unsafe",
+        "render", "render autoescape"
+    ), float("inf"))
+    functions = {
+        "str() safe": lambda: str(CONTEXT["title"]),
+        "escape safe": lambda: _escape_value(CONTEXT["title"]),
+        "str() unsafe": lambda: str(CONTEXT["body"]),
+        "escape unsafe": lambda: _escape_value(CONTEXT["body"]),
+        "render": lambda: plain.render(**CONTEXT),
+        "render autoescape": lambda: escaped.render(**CONTEXT)
+    }
+    for _ in range(args.repeat):
+        for name, function in functions.items():
+            number = args.number * (100 if "()" in name or "escape " in name else 1)
+            results[name] = min(results[name], timeit(function, number=number) / number)
+    for name, seconds in results.items():
+        print(f"{name:<18} {seconds * 1e9:10.1f}ns")
+    print(f"overhead           {results['render autoescape'] / results['render']:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
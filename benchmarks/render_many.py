@@ -0,0 +1,59 @@
+# miko - Benchmark of render_many
+
+from __future__ import annotations
+
+from timeit import timeit
+import argparse
+
+from miko import Template
+
+
+TEMPLATE = """<html>
+  <head><title>^^ title ^^</title></head>
+  <body>
+    ^^
+      lines = []
+      for item in items:
+          lines.append(f"<li>{escape(item)}</li>")
+      "\\n".join(lines)
+    ^^
+    <p>^^ truncate(description, 40) ^^</p>
+  </body>
+</html>"""
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare rendering many contexts with a loop of render and with render_many."
+    )
+    parser.add_argument("-n", "--number", type=int, default=10000, help="The number of the contexts.")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="How many times to measure.")
+    args = parser.parse_args(argv)
+
+    template = Template(TEMPLATE, path="benchmark.html")
+    contexts = [
+        {
+            "title": f"Page {i}", "items": [str(i), "<b>", "c"],
+            "description": "miko " * 20
+        } for i in range(args.number)
+    ]
+    assert [template.render(**context) for context in contexts] \
+        == list(template.render_many(contexts))
+
+    # 環境による揺れを減らすため、交互に測って最小値を使う。
+    loop = many = float("inf")
+    for _ in range(args.repeat):
+        loop = min(loop, timeit(
+            lambda: [template.render(**context) for context in contexts],
+            number=1
+        ))
+        many = min(many, timeit(
+            lambda: list(template.render_many(contexts)), number=1
+        ))
+    for name, seconds in (("render", loop), ("render_many", many)):
+        print(f"{name:<12} {seconds / args.number * 1e6:8.2f}us per item")
+    print(f"speedup      {loop / many:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# miko - Benchmark suite
+
+from __future__ import annotations
+
+from collections.abc import Callable, Iterator
+from typing import Any
+
+from tempfile import TemporaryDirectory
+from timeit import Timer
+from inspect import signature
+from itertools import chain
+from fnmatch import fnmatch
+import argparse
+import platform
+import asyncio
+import json
+import sys
+import os
+
+import miko
+from miko import Template, Manager, Block, CacheManager
+from miko.parser import extract_blocks
+
+
+SIZES = {"small": 16, "medium": 256, "large": 4096}
+"The length of the static text between the blocks of each size."
+BLOCKS = (1, 10, 100, 1000)
+DEPTHS = (1, 3, 5)
+"The lengths of the chains of ``self.extends``."
+
+
+def make_template(blocks: int, text_size: int) -> str:
+    "Make a template which has the blocks and the static text of the length between them."
+    text = ("lorem ipsum " * (text_size // 12 + 1))[:text_size]
+    parts = []
+    for index in range(blocks):
+        parts.append(text)
+        if index % 5 == 4:
+            # 文を含むブロックも混ぜる。
+            parts.append(
+                "^^\n  rows = []\n  for item in items:\n"
+                "      rows.append(f\"<li>{item}</li>\")\n  \"\".join(rows)\n^^"
+            )
+        else:
+            parts.append(f"^^ value{index % 10} ^^")
+    parts.append(text)
+    return "".join(parts)
+
+
+CONTEXT = {f"value{index}": index for index in range(10)} | {"items": ["a", "b", "c"]}
+
+
+def measure(function: Callable[[], Any], repeat: int, minimum: float) -> dict[str, float]:
+    "Measure the function and return the best time of one call and how many times it was called."
+    timer = Timer(function)
+    number, _ = timer.autorange()
+    number = max(number, int(number * minimum / 0.2))
+    best = min(timer.repeat(repeat, number)) / number
+    return {"seconds": best, "number": number, "repeat": repeat}
+
+
+def clear_caches() -> None:
+    "Empty the shared cache of the compiled blocks. This is used for the releases whose ``Template`` has no ``cache_manager``."
+    caches = miko.caches
+    if hasattr(caches, "invalidate"):
+        caches.invalidate()
+    else:
+        caches.block_caches.clear()
+
+
+# 古いリリースと比べられるように、新しい引数が無い場合はそれを使わない。
+HAS_CACHE_MANAGER = "cache_manager" in signature(Template.__init__).parameters
+
+
+def cases(
+    quick: bool, pattern: str, loop: asyncio.AbstractEventLoop
+) -> Iterator[tuple[str, dict[str, Any], Callable[[], Any]]]:
+    "Yield the names, the parameters and the functions of the benchmarks whose names match ``pattern``."
+    # 重い準備をしないように、名前を絞り込んでから作る。
+    for size, text_size in SIZES.items():
+        for blocks in BLOCKS:
+            if quick and (size == "large" and blocks == 1000):
+                continue
+            parameters = {"size": size, "blocks": blocks}
+            source = make_template(blocks, text_size)
+            path = f"{size}-{blocks}.html"
+
+            if fnmatch("extract_blocks", pattern):
+                yield "extract_blocks", parameters, lambda source=source: list(extract_blocks(source))
+
+            if fnmatch("block_compile", pattern):
+                texts = [text for _, is_block, text in extract_blocks(source) if is_block]
+                yield "block_compile", parameters, lambda texts=texts: [
+                    Block(text, tuple(CONTEXT), "benchmark.html", index)
+                    for index, text in enumerate(texts)
+                ]
+
+            if fnmatch("render_cold", pattern):
+                def cold(source=source, path=path):
+                    if HAS_CACHE_MANAGER:
+                        Template(source, path=path, cache_manager=CacheManager()).render(**CONTEXT)
+                    else:
+                        clear_caches()
+                        Template(source, path=path).render(**CONTEXT)
+                yield "render_cold", parameters, cold
+
+            if fnmatch("render_warm", pattern):
+                template = Template(source, path=path)
+                template.render(**CONTEXT)
+                yield "render_warm", parameters, lambda template=template: template.render(**CONTEXT)
+            if fnmatch("aiorender_warm", pattern):
+                # 古いリリースではキャッシュのキーに非同期かどうかが含まれないので、別のパスにする。
+                template = Template(source, path=f"{path}.async")
+                loop.run_until_complete(template.aiorender(**CONTEXT))
+                yield "aiorender_warm", parameters, lambda template=template: \
+                    loop.run_until_complete(template.aiorender(**CONTEXT))
+
+
+def chain_cases(
+    directory: str, pattern: str
+) -> Iterator[tuple[str, dict[str, Any], Callable[[], Any]]]:
+    "Yield the benchmarks of ``Manager.render`` with the chains of ``self.extends`` and ``include``."
+    if not fnmatch("manager_render_chain", pattern):
+        return
+    include = os.path.join(directory, "include.txt")
+    with open(include, "w") as f:
+        f.write(make_template(0, SIZES["medium"]))
+    for depth in DEPTHS:
+        previous = None
+        for level in range(depth):
+            path = os.path.join(directory, f"chain-{depth}-{level}.html")
+            body = make_template(10, SIZES["small"])
+            if previous is None:
+                body += f"^^ include({include!r}) ^^"
+            else:
+                body += "^^ self.extends(" + repr(previous) + ", " \
+                    + ", ".join(f"{name}={name}" for name in CONTEXT) + ") ^^"
+            with open(path, "w") as f:
+                f.write(body)
+            previous = path
+        assert previous is not None
+        manager = Manager()
+        manager.render(previous, **CONTEXT)
+        yield "manager_render_chain", {"depth": depth}, \
+            lambda manager=manager, path=previous: manager.render(path, **CONTEXT)
+
+
+def get_key(result: dict[str, Any]) -> tuple:
+    "Get the key to find the same benchmark in the results of another run."
+    return tuple(sorted(
+        (name, value) for name, value in result.items()
+        if name not in ("seconds", "number", "repeat")
+    ))
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Run the benchmarks of miko and print the results as JSON.")
+    parser.add_argument("-o", "--output", default=None, help="The file to write the results to. (default: stdout)")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="How many times to measure each benchmark.")
+    parser.add_argument("-m", "--minimum", type=float, default=0.2, help="The minimum time of a measurement in seconds.")
+    parser.add_argument("-k", "--filter", default="*", help="The glob pattern of the names of the benchmarks to run.")
+    parser.add_argument("-q", "--quick", action="store_true", help="Skip the largest template.")
+    parser.add_argument("-c", "--compare", default=None, help="The JSON file of the results of another run to compare with.")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            baseline = {
+                get_key(result): result["seconds"] for result in json.load(f)["results"]
+            }
+
+    results = []
+    loop = asyncio.new_event_loop()
+    try:
+        with TemporaryDirectory() as directory:
+            for name, parameters, function in chain(
+                cases(args.quick, args.filter, loop), chain_cases(directory, args.filter)
+            ):
+                result = {"name": name, **parameters, **measure(function, args.repeat, args.minimum)}
+                results.append(result)
+                old = baseline.get(get_key(result))
+                print(
+                    f"{name:<22} {json.dumps(parameters):<32} {result['seconds'] * 1e6:12.2f}us"
+                    + ("" if old is None else f" {old / result['seconds']:8.2f}x"),
+                    file=sys.stderr
+                )
+    finally:
+        loop.close()
+
+    data = json.dumps({
+        "miko": miko.__version__, "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(), "results": results
+    }, indent=2)
+    if args.output is None:
+        print(data)
+    else:
+        with open(args.output, "w") as f:
+            f.write(data)
+
+
+if __name__ == "__main__":
+    main()
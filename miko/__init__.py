@@ -4,13 +4,18 @@ from .template import (
     DEFAULT_BUILTINS, DEFAULT_ADJUSTORS, Adjustor,
     Template, Block, CacheManager, caches
 )
-from .manager import Manager
+from .manager import PreloadReport, RenderResult, Manager
+from .bytecode import BytecodeCache
+from .builder import BuildReport, Builder
+from .profiler import Instrument, ProfileEntry, Profiler
 from . import builtins
 
 
 __all__ = (
     "DEFAULT_BUILTINS", "DEFAULT_ADJUSTORS", "Adjustor",
-    "Template", "Block", "CacheManager", "caches", "Manager", "builtins"
+    "Template", "Block", "CacheManager", "caches", "Manager", "builtins",
+    "BytecodeCache", "PreloadReport", "RenderResult", "BuildReport", "Builder",
+    "Instrument", "ProfileEntry", "Profiler"
 )
 
 
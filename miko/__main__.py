@@ -0,0 +1,92 @@
+# miko - Command Line Interface
+
+from __future__ import annotations
+
+from argparse import ArgumentParser
+import json
+import sys
+
+from .template import CacheManager
+from .manager import Manager
+from .builder import Builder
+from . import template
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = ArgumentParser(
+        "miko", description="Little, lightweight and fast template engine."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    preload = subparsers.add_parser(
+        "preload", help="Compile all the templates under a directory to check them."
+    )
+    preload.add_argument("root", help="The directory where the templates are.")
+    preload.add_argument(
+        "-p", "--pattern", default="**/*.html",
+        help="The glob pattern of the templates. (default: **/*.html)"
+    )
+    preload.add_argument(
+        "-b", "--bytecode-cache", default=None,
+        help="The directory to store the compiled templates in."
+    )
+    preload.add_argument(
+        "-a", "--async", dest="async_function", action="store_true",
+        help="Compile the templates for asynchronous rendering."
+    )
+
+    build = subparsers.add_parser(
+        "build", help="Render all the templates under a directory to another directory."
+    )
+    build.add_argument("source", help="The directory where the templates are.")
+    build.add_argument("output", help="The directory where the rendered files are written.")
+    build.add_argument(
+        "-p", "--pattern", default="**/*.html",
+        help="The glob pattern of the templates. (default: **/*.html)"
+    )
+    build.add_argument(
+        "-e", "--exclude", default="_*",
+        help="The file name pattern of the templates not to be rendered. (default: _*)"
+    )
+    build.add_argument(
+        "-c", "--context", default=None,
+        help="The JSON file of the values passed to all the templates."
+    )
+    build.add_argument(
+        "-m", "--manifest", default=None,
+        help="The path to the manifest file. (default: OUTPUT/.miko-manifest.json)"
+    )
+    build.add_argument(
+        "-f", "--force", action="store_true",
+        help="Render all the templates even if they have not been changed."
+    )
+    build.add_argument(
+        "-b", "--bytecode-cache", default=None,
+        help="The directory to store the compiled templates in."
+    )
+
+    args = parser.parse_args(argv)
+    if args.bytecode_cache is not None:
+        template.caches = CacheManager(bytecode_cache=args.bytecode_cache)
+    if args.command == "preload":
+        preload_report = Manager().preload(
+            args.root, args.pattern, async_function=args.async_function
+        )
+        print(preload_report)
+        return 1 if preload_report.errors else 0
+    if args.command == "build":
+        context = None
+        if args.context is not None:
+            with open(args.context, "r") as f:
+                context = json.load(f)
+        build_report = Builder(
+            args.source, args.output, pattern=args.pattern,
+            exclude=args.exclude, manifest=args.manifest, context=context
+        ).build(args.force)
+        print(build_report)
+        return 1 if build_report.errors else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
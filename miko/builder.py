@@ -0,0 +1,223 @@
+# miko - Builder
+
+from __future__ import annotations
+
+from typing import Any
+from dataclasses import dataclass, field
+
+from fnmatch import fnmatch
+from hashlib import blake2b
+from time import perf_counter
+from glob import glob
+import json
+import os
+
+from .builtins import track_dependencies
+from .manager import Manager
+
+
+__all__ = ("BuildReport", "Builder")
+
+
+@dataclass
+class BuildReport:
+    "The result of :meth:`miko.builder.Builder.build`."
+
+    rendered: list[str] = field(default_factory=list)
+    "The paths of the files written."
+    skipped: int = 0
+    "The number of the files which were not rendered because nothing they depend on has been changed."
+    removed: list[str] = field(default_factory=list)
+    "The paths of the files removed because their templates were removed."
+    seconds: float = 0.0
+    "How long it took."
+    errors: dict[str, Exception] = field(default_factory=dict)
+    "The paths of the templates that could not be rendered and the errors."
+
+    def __str__(self) -> str:
+        return "{} rendered, {} skipped, {} removed in {:.3f}s{}".format(
+            len(self.rendered), self.skipped, len(self.removed), self.seconds,
+            "".join(
+                f"\n{path}: {error.__class__.__name__}: {error}"
+                for path, error in self.errors.items()
+            )
+        )
+
+
+def _digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return blake2b(f.read(), digest_size=16).hexdigest()
+
+
+class Builder:
+    """This class renders all the templates in a directory to another directory, like a static site generator.
+    It records the files each output depends on, such as the ones used by ``self.extends`` and ``include``, in a manifest file.
+    So the next build renders only the outputs whose files have been changed.
+
+    Parameters
+    ----------
+    source : str
+        The directory where the templates are.
+    output : str
+        The directory where the rendered files are written.
+    manager : Manager | None, default None
+        The manager used to render the templates. If it is ``None``, a new one is made.
+    pattern : str, default "**/*.html"
+        The glob pattern of the templates relative to ``source``.
+    exclude : str, default "_*"
+        The templates whose file name matches this pattern are not rendered. Use it for the templates only used by other templates, such as ``_base.html``.
+    manifest : str | None, default None
+        The path to the manifest file. If it is ``None``, it is ``.miko-manifest.json`` in ``output``.
+    context : dict[str, Any] | None, default None
+        The values passed to all the templates. If they are changed, all the files are rendered again.
+
+    Attributes
+    ----------
+    source : str
+    output : str
+    manager : Manager
+    pattern : str
+    exclude : str
+    manifest : str
+    context : dict[str, Any]
+
+    Notes
+    -----
+    A file is regarded as changed when its last modified date or size is different and its hash is also different.
+    So touching a file does not render the outputs again.
+    The paths used by the templates are relative to the current directory, so run it in the same directory every time."""
+
+    def __init__(
+        self, source: str, output: str, manager: Manager | None = None,
+        pattern: str = "**/*.html", exclude: str = "_*",
+        manifest: str | None = None, context: dict[str, Any] | None = None
+    ):
+        self.source, self.output = source, output
+        self.manager = Manager() if manager is None else manager
+        self.pattern, self.exclude = pattern, exclude
+        self.manifest = os.path.join(output, ".miko-manifest.json") \
+            if manifest is None else manifest
+        self.context = context or {}
+
+    def _get_context_key(self) -> str:
+        from . import __version__
+        return blake2b(repr((
+            __version__, sorted(self.context.items())
+        )).encode(), digest_size=16).hexdigest()
+
+    def load_manifest(self) -> dict[str, Any]:
+        """Load the manifest file. If there is no file or it is broken, an empty manifest is returned.
+
+        Returns
+        -------
+        dict[str, Any]
+            The manifest. ``outputs`` is a dictionary of the paths of the outputs and their templates and dependencies.
+            The dependencies are dictionaries of the paths and lists of the last modified date, the size and the hash."""
+        try:
+            with open(self.manifest, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+        if not isinstance(manifest, dict) or not isinstance(manifest.get("outputs"), dict):
+            manifest = {"context": None, "outputs": {}}
+        return manifest
+
+    def save_manifest(self, manifest: dict[str, Any]) -> None:
+        "Write the manifest file. It is written to a temporary file and replaced at once."
+        directory = os.path.dirname(self.manifest)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{self.manifest}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(temporary, self.manifest)
+
+    def _is_fresh(self, dependencies, states):
+        # 同じビルドでは同じファイルを何度も調べないように、結果を`states`に入れておく。
+        for path, recorded in dependencies.items():
+            state = states.get(path)
+            if state is None:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    return False
+                state = [stat.st_mtime_ns, stat.st_size, None]
+                if state[:2] == recorded[:2]:
+                    state[2] = recorded[2]
+                else:
+                    state[2] = _digest(path)
+                states[path] = state
+            if state[2] != recorded[2]:
+                return False
+            recorded[:2] = state[:2]
+        return True
+
+    def _get_states(self, paths, states):
+        for path in paths:
+            if path not in states:
+                stat = os.stat(path)
+                states[path] = [stat.st_mtime_ns, stat.st_size, _digest(path)]
+        return {path: list(states[path]) for path in sorted(paths)}
+
+    def build(self, force: bool = False) -> BuildReport:
+        """Render the templates whose dependencies have been changed since the last build and update the manifest.
+
+        Parameters
+        ----------
+        force : bool, default False
+            Whether to render all the templates.
+
+        Returns
+        -------
+        BuildReport
+            The paths of the rendered files and the errors.
+            Errors do not stop the build, and the templates with errors are rendered again next time."""
+        report, start = BuildReport(), perf_counter()
+        manifest, context_key = self.load_manifest(), self._get_context_key()
+        if force or manifest.get("context") != context_key:
+            manifest = {"context": context_key, "outputs": {}}
+        outputs = manifest["outputs"]
+        states: dict[str, list] = {}
+        sources = set()
+        for name in sorted(glob(self.pattern, root_dir=self.source, recursive=True)):
+            path = os.path.normpath(os.path.join(self.source, name))
+            if not os.path.isfile(path) or fnmatch(os.path.basename(path), self.exclude):
+                continue
+            sources.add(path)
+            output = os.path.normpath(os.path.join(self.output, name))
+            entry = outputs.get(output)
+            if entry is not None and entry.get("source") == path \
+                    and os.path.exists(output) \
+                    and self._is_fresh(entry["dependencies"], states):
+                report.skipped += 1
+                continue
+            try:
+                with track_dependencies() as dependencies:
+                    text = self.manager.render(path, **self.context)
+                directory = os.path.dirname(output)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(output, "w") as f:
+                    f.write(text)
+                outputs[output] = {
+                    "source": path,
+                    "dependencies": self._get_states(dependencies.keys() | {path}, states)
+                }
+            except Exception as error:
+                outputs.pop(output, None)
+                report.errors[path] = error
+            else:
+                report.rendered.append(output)
+        # テンプレートが消された出力を消す。
+        for output, entry in list(outputs.items()):
+            if entry.get("source") not in sources:
+                del outputs[output]
+                try:
+                    os.remove(output)
+                except OSError:
+                    pass
+                else:
+                    report.removed.append(output)
+        self.save_manifest(manifest)
+        report.seconds = perf_counter() - start
+        return report
@@ -2,17 +2,290 @@
 
 from __future__ import annotations
 
-from collections import defaultdict
-from html import escape
+from typing import Any
+from collections.abc import Callable, Iterable, Iterator, Hashable
+from abc import ABC, abstractmethod
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from asyncio import wrap_future, shield
+from contextlib import contextmanager
+from contextvars import ContextVar
+from inspect import isawaitable
+from html import escape as _escape
 from os import stat
+from time import monotonic
+from threading import Thread, Event, RLock
+
+from .utils import LRUCache, _get_all
+
+
+__all__ = (
+    "include", "aioinclude", "cache", "aiocache", "Markup", "escape",
+    "truncate", "CS"
+)
+
+
+class Markup(str):
+    """This is a string which is regarded as safe HTML.
+    When ``autoescape`` of :class:`miko.template.Template` is enabled, the value of a block which is an instance of this class is not escaped.  
+    The contents of the files read by :func:`miko.builtins.include`, the outputs of ``self.extends`` and the values returned by :func:`miko.builtins.escape` are instances of this class.
+
+    Notes
+    -----
+    Only the whole value is safe. The result of an operation such as ``+`` is a normal string."""
+
+    __slots__ = ()
+
+    def __html__(self) -> Markup:
+        return self
+
+
+def escape(s: str, quote: bool = True) -> Markup:
+    """Escape the characters ``&``, ``<`` and ``>`` (and ``"`` and ``'`` if ``quote`` is ``True``) of HTML.
+    This is the same as ``html.escape`` except that it returns :class:`miko.builtins.Markup`, so the value is not escaped again by ``autoescape``.
+
+    Parameters
+    ----------
+    s : str
+    quote : bool, default True"""
+    return Markup(_escape(s, quote))
+
+
+def _escape_value(value: Any) -> str:
+    # `autoescape`で使う。エスケープする必要のない文字列はそのまま返す。
+    cls = value.__class__
+    if cls is str:
+        if "&" in value or "<" in value or ">" in value \
+                or '"' in value or "'" in value:
+            return _escape(value)
+        return value
+    if cls is Markup:
+        return value
+    if cls is int:
+        return str(value)
+    html = getattr(value, "__html__", None)
+    if html is not None:
+        return html()
+    value = str(value)
+    if "&" in value or "<" in value or ">" in value \
+            or '"' in value or "'" in value:
+        return _escape(value)
+    return value
+
+
+class FileCache:
+    """This is the cache of the contents of files used by :func:`miko.builtins.include`.  
+    The last modified date of a file is checked to know whether the file has been changed, and how often it is checked can be configured.
+
+    Parameters
+    ----------
+    check_interval : float | None, default 0.0
+        How often to check the last modified date of a cached file, in seconds.  
+        If it is ``0``, it is checked every time. If it is ``None``, it is never checked and the file is read again only after :meth:`miko.builtins.FileCache.invalidate` or :meth:`miko.builtins.FileCache.reload`.
+    max_entries : int | None, default 1024
+        The maximum number of the cached files. If it is ``None``, there is no limit.
+    max_bytes : int | None, default None
+        The maximum total length of the cached contents. If it is ``None``, there is no limit.
+    max_workers : int, default 4
+        The maximum number of the threads used by :meth:`miko.builtins.FileCache.aioread` to read files.
+
+    Attributes
+    ----------
+    check_interval : float | None
+    entries : LRUCache[str, list]
+        The cache. The values are lists of the last modified date, the content and the time when it was checked.
+    max_workers : int"""
+
+    def __init__(
+        self, check_interval: float | None = 0.0,
+        max_entries: int | None = 1024, max_bytes: int | None = None,
+        max_workers: int = 4
+    ):
+        self.check_interval, self.max_workers = check_interval, max_workers
+        self.entries: LRUCache[str, list] = LRUCache(max_entries, max_bytes)
+        self._watcher: Thread | None = None
+        self._stop = Event()
+        self._executor: ThreadPoolExecutor | None = None
+        self._loading: dict[str, Future] = {}
+        self._lock = RLock()
+
+    def _load(self, path: str, mtime: int) -> str:
+        with open(path, "r") as f:
+            # 読み込んだファイルは信頼できるものなので、自動エスケープされないようにする。
+            text = Markup(f.read())
+        self.entries.set(path, [mtime, text, monotonic()], len(text))
+        return text
+
+    def read(self, path: str) -> str:
+        """Get the content of the file. If the file has not been changed, the cached one is returned.
+
+        Parameters
+        ----------
+        path : str
+            The path to the file."""
+        entry = self.entries.get(path)
+        if entry is not None:
+            if self._watcher is not None or self.check_interval is None \
+                    or monotonic() - entry[2] < self.check_interval:
+                return entry[1]
+        mtime = stat(path).st_mtime_ns
+        if entry is not None and entry[0] == mtime:
+            entry[2] = monotonic()
+            return entry[1]
+        return self._load(path, mtime)
+
+    def _get_fresh(self, path):
+        # キャッシュされた内容が使えるならそれを返す。`stat`はすぐ終わるので、スレッドを使わずにここで確認する。
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        if self._watcher is not None or self.check_interval is None \
+                or monotonic() - entry[2] < self.check_interval:
+            return entry[1]
+        try:
+            mtime = stat(path).st_mtime_ns
+        except OSError:
+            return None
+        if entry[0] == mtime:
+            entry[2] = monotonic()
+            return entry[1]
+        return None
+
+    async def aioread(self, path: str) -> str:
+        """This is an asynchronous version of :meth:`miko.builtins.FileCache.read`.  
+        The file is read in the threads of this class, and only one thread reads the same file at the same time.  
+        The last modified date of a cached file is checked without using a thread, so the cached content is returned without waiting for the threads.
+
+        Parameters
+        ----------
+        path : str
+            The path to the file."""
+        text = self._get_fresh(path)
+        if text is not None:
+            return text
+        with self._lock:
+            # 同じファイルを読み込んでいる最中なら、それを待つ。
+            future = self._loading.get(path)
+            if future is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        self.max_workers, thread_name_prefix="miko-file"
+                    )
+                future = self._executor.submit(self.read, path)
+                self._loading[path] = future
+                future.add_done_callback(lambda _: self._finish_loading(path, future))
+        # 待っている一つがキャンセルされても、同じファイルを待っている他のものまでキャンセルされないようにする。
+        return await shield(wrap_future(future))
+
+    def _finish_loading(self, path, future):
+        with self._lock:
+            if self._loading.get(path) is future:
+                del self._loading[path]
+
+    def invalidate(self, path: str | None = None) -> None:
+        """Remove the cached content so that the file is read again next time.
+
+        Parameters
+        ----------
+        path : str | None, default None
+            The path to the file. If it is ``None``, all the contents are removed."""
+        if path is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(path)
+
+    def reload(self, path: str | None = None) -> None:
+        """Read the cached files again now.
+
+        Parameters
+        ----------
+        path : str | None, default None
+            The path to the file. If it is ``None``, all the cached files are read again."""
+        for path in (self.entries.keys() if path is None else (path,)):
+            try:
+                self._load(path, stat(path).st_mtime_ns)
+            except OSError:
+                self.entries.pop(path)
+
+    def watch(self, interval: float = 1.0) -> None:
+        """Start a thread that checks the cached files and removes the ones which have been changed.  
+        While it is running, :meth:`miko.builtins.FileCache.read` does not check the files at all.
+
+        Parameters
+        ----------
+        interval : float, default 1.0
+            How often to check the files, in seconds."""
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = Thread(
+            target=self._watch, args=(interval,),
+            name="miko-file-watcher", daemon=True
+        )
+        self._watcher.start()
+
+    def _watch(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            for path in self.entries.keys():
+                entry = self.entries.peek(path)
+                if entry is None:
+                    continue
+                try:
+                    changed = stat(path).st_mtime_ns != entry[0]
+                except OSError:
+                    changed = True
+                if changed:
+                    self.entries.pop(path)
+
+    def stop_watching(self) -> None:
+        "Stop the thread started by :meth:`miko.builtins.FileCache.watch`."
+        if self._watcher is not None:
+            self._stop.set()
+            self._watcher.join()
+            self._watcher = None
+files = FileCache()
+"The instance of :class:`miko.builtins.FileCache` used by :func:`miko.builtins.include`."
+
+
+_dependencies: ContextVar[dict[str, str] | None] = ContextVar("miko_dependencies", default=None)
+
+
+def _record_dependency(path: str, text: str) -> None:
+    dependencies = _dependencies.get()
+    if dependencies is not None:
+        dependencies.setdefault(path, text)
+
 
-from .utils import _get_all, _executor_function
+@contextmanager
+def track_dependencies() -> Iterator[dict[str, str]]:
+    """Collect the paths of the files used while rendering in this context.  
+    The files read by :func:`miko.builtins.include` and :func:`miko.builtins.aioinclude` and the templates got by :class:`miko.manager.Manager` are collected.
 
+    Yields
+    ------
+    dict[str, str]
+        The dictionary to which the paths and the contents used for the rendering are added.
 
-__all__ = ("include", "aioinclude", "escape", "truncate", "CS")
+    Examples
+    --------
+    .. code-block:: python
+
+        with track_dependencies() as dependencies:
+            manager.render("page.html")
+        print(list(dependencies)) # ["page.html", "base.html"]"""
+    outer = _dependencies.get()
+    dependencies: dict[str, str] = {}
+    token = _dependencies.set(dependencies)
+    try:
+        yield dependencies
+    finally:
+        _dependencies.reset(token)
+        # 入れ子になっている場合は、外側にも記録する。
+        if outer is not None:
+            for path, text in dependencies.items():
+                outer.setdefault(path, text)
 
 
-_include_caches: defaultdict[str, list] = defaultdict(lambda : [0, None])
 def include(path: str) -> str:
     """Insert other files.
 
@@ -23,28 +296,217 @@ def include(path: str) -> str:
 
     Notes
     -----
-    Use the last modified date of the file to cache it.
+    Use the last modified date of the file to cache it.  
+    The cache is :data:`miko.builtins.files`, and you can configure how often the file is checked with it.
 
     See Also
     --------
     Template.extends : Render and embed other files."""
-    mtime = stat(path).st_mtime
-    if mtime == _include_caches[path][0]:
-        return _include_caches[path][1]
-    _include_caches[path][0] = mtime
-    with open(path, "r") as f:
-        _include_caches[path][1] = f.read()
-    return _include_caches[path][1]
+    text = files.read(path)
+    _record_dependency(path, text)
+    return text
 
 
 async def aioinclude(path: str) -> str:
     """This is an asynchronous version of version for :func:`miko.builtins.include`.  
-    Use the ``run_in_executor`` of event loop.
+    The file is read by :meth:`miko.builtins.FileCache.aioread` of :data:`miko.builtins.files`.
 
     Parameters
     ----------
     path : str"""
-    return await _executor_function(include, None, path)
+    # 別のスレッドではコンテキストが引き継がれないので、ここで記録する。
+    text = await files.aioread(path)
+    _record_dependency(path, text)
+    return text
+
+
+class FragmentBackend(ABC):
+    """This is the interface of the stores used by :func:`miko.builtins.cache`.  
+    If you want to share the cached fragments between processes, for example with Redis, make a subclass of this and set it to :data:`miko.builtins.fragments`.
+
+    See Also
+    --------
+    LocalFragmentBackend : The store in the memory of the process."""
+
+    @abstractmethod
+    def get(self, key: Hashable) -> str | None:
+        "Get the cached fragment. If there is no fragment or it has expired, ``None`` is returned."
+
+    @abstractmethod
+    def set(
+        self, key: Hashable, value: str, ttl: float | None = None,
+        tags: Iterable[str] = ()
+    ) -> None:
+        """Store the fragment.
+
+        Parameters
+        ----------
+        key : Hashable
+        value : str
+        ttl : float | None, default None
+            How long the fragment is valid, in seconds. If it is ``None``, it does not expire.
+        tags : Iterable[str], default ()
+            The tags used by :meth:`miko.builtins.FragmentBackend.invalidate_tags`."""
+
+    @abstractmethod
+    def invalidate(self, key: Hashable) -> None:
+        "Remove the fragment of the key."
+
+    @abstractmethod
+    def invalidate_tags(self, *tags: str) -> None:
+        "Remove all the fragments which have one of the tags."
+
+    @abstractmethod
+    def clear(self) -> None:
+        "Remove all the fragments."
+
+
+class LocalFragmentBackend(FragmentBackend):
+    """The store of fragments in the memory of the process.
+
+    Parameters
+    ----------
+    max_entries : int | None, default 1024
+        The maximum number of the fragments. If it is ``None``, there is no limit.
+    max_bytes : int | None, default None
+        The maximum total length of the fragments. If it is ``None``, there is no limit.
+
+    Attributes
+    ----------
+    entries : LRUCache[Hashable, tuple[str, float | None, frozenset[str]]]
+        The cache. The values are tuples of the fragment, the time when it expires and its tags.
+    tags : dict[str, set[Hashable]]
+        The keys of the fragments of each tag."""
+
+    def __init__(
+        self, max_entries: int | None = 1024, max_bytes: int | None = None
+    ):
+        self.entries: LRUCache[
+            Hashable, tuple[str, float | None, frozenset[str]]
+        ] = LRUCache(max_entries, max_bytes)
+        self.tags: dict[str, set[Hashable]] = {}
+        self._lock = RLock()
+
+    def get(self, key: Hashable) -> str | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and monotonic() >= entry[1]:
+            self.invalidate(key)
+            return None
+        return entry[0]
+
+    def set(
+        self, key: Hashable, value: str, ttl: float | None = None,
+        tags: Iterable[str] = ()
+    ) -> None:
+        tags = frozenset(tags)
+        with self._lock:
+            old = self.entries.peek(key)
+            if old is not None:
+                self._forget(key, old[2])
+            self.entries.set(
+                key, (value, None if ttl is None else monotonic() + ttl, tags),
+                len(value)
+            )
+            for tag in tags:
+                keys = self.tags.setdefault(tag, set())
+                keys.add(key)
+                # 容量制限で消えたキーが残り続けないように、増えすぎたら整理する。
+                if len(keys) > len(self.entries):
+                    keys.intersection_update(self.entries.keys())
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            entry = self.entries.pop(key)
+            if entry is not None:
+                self._forget(key, entry[2])
+
+    def _forget(self, key, tags):
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    def invalidate_tags(self, *tags: str) -> None:
+        with self._lock:
+            for tag in tags:
+                for key in self.tags.pop(tag, ()):
+                    # 容量制限で消えた後に別のタグで設定し直されたキーもあるので、今のタグを確認する。
+                    entry = self.entries.peek(key)
+                    if entry is not None and tag in entry[2]:
+                        self.invalidate(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self.tags.clear()
+fragments: FragmentBackend = LocalFragmentBackend()
+"""The store used by :func:`miko.builtins.cache` and :func:`miko.builtins.aiocache`.  
+You can replace it with another :class:`miko.builtins.FragmentBackend`."""
+
+
+def cache(
+    key: Hashable, function: Callable[[], Any], ttl: float | None = None,
+    tags: Iterable[str] = ()
+) -> str:
+    """Cache the output of a part of a template.  
+    If the fragment of the key is cached, it is returned without calling ``function``.
+
+    Parameters
+    ----------
+    key : Hashable
+        The key of the fragment. It should include everything the output depends on, such as the language.
+    function : Callable[[], Any]
+        The function that makes the fragment. Its return value is converted by ``str`` unless it is already a string, so :class:`miko.builtins.Markup` is kept.
+    ttl : float | None, default None
+        How long the fragment is valid, in seconds. If it is ``None``, it is valid until it is invalidated or removed to keep the limits.
+    tags : Iterable[str], default ()
+        The tags to invalidate the fragments at once with ``fragments.invalidate_tags``.
+
+    Examples
+    --------
+    .. code-block:: html
+
+      ^^ cache(("sidebar", lang), lambda: self.extends("sidebar.html", lang=lang), 60, ("menu",)) ^^
+
+    Notes
+    -----
+    Use ``fragments.invalidate(key)`` of :data:`miko.builtins.fragments` to remove a fragment when its data is changed."""
+    value = fragments.get(key)
+    if value is None:
+        value = function()
+        # `Markup`のままにして、自動エスケープで二重にエスケープされないようにする。
+        if not isinstance(value, str):
+            value = str(value)
+        fragments.set(key, value, ttl, tags)
+    return value
+
+
+async def aiocache(
+    key: Hashable, function: Callable[[], Any], ttl: float | None = None,
+    tags: Iterable[str] = ()
+) -> str:
+    """This is an asynchronous version of :func:`miko.builtins.cache`.  
+    If ``function`` returns an awaitable object, such as a coroutine made by ``self.aioextends``, it is awaited.
+
+    Parameters
+    ----------
+    key : Hashable
+    function : Callable[[], Any]
+    ttl : float | None, default None
+    tags : Iterable[str], default ()"""
+    value = fragments.get(key)
+    if value is None:
+        value = function()
+        if isawaitable(value):
+            value = await value
+        if not isinstance(value, str):
+            value = str(value)
+        fragments.set(key, value, ttl, tags)
+    return value
 
 
 def truncate(text: str, length: int = 255, end: str = "...") -> str:
@@ -72,7 +534,8 @@ def truncate(text: str, length: int = 255, end: str = "...") -> str:
 
 CS = r"^^"
 """This is just a constant with two caret signs in it.  
-Use this when you want to use two caret signs side by side in a string defined in the Python code in the block."""
+Use this when you want to use two caret signs side by side in a string defined in the Python code in the block.  
+You can also write ``\\^^`` in the template instead of this. (See :func:`miko.parser.tokenize`)"""
 
 
 _builtins = _get_all(globals(), __all__)
\ No newline at end of file
@@ -0,0 +1,115 @@
+# miko - Bytecode Cache
+
+from __future__ import annotations
+
+from typing import Any
+
+from importlib.util import MAGIC_NUMBER
+from tempfile import mkstemp
+from hashlib import blake2b
+import marshal
+import os
+
+
+__all__ = ("BytecodeCache",)
+
+
+_DIGEST_SIZE = 16
+_HEADER_SIZE = len(MAGIC_NUMBER) + _DIGEST_SIZE * 2
+
+
+class BytecodeCache:
+    """This class stores compiled templates in a directory like ``__pycache__``.
+    By passing it to :class:`miko.template.CacheManager`, a new process can load the compiled templates instead of compiling them.
+
+    Parameters
+    ----------
+    directory : str
+        The directory where the files are stored. It is created if it does not exist.
+
+    Attributes
+    ----------
+    directory : str
+
+    Notes
+    -----
+    The name of a file is the hash of the version of miko and Python, the path and the content of the template and the names of the values.
+    So a file of an old version of a template is never loaded.
+    Each file has a header containing the hash of its key and of its data, and a broken file is ignored and written again.
+    Files are written to a temporary file and replaced at once, so it is safe when multiple processes write the same file."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get_key(self, *parts: Any) -> bytes:
+        """Make the key of a file from the passed values.
+
+        Parameters
+        ----------
+        *parts : Any
+            The values which the stored data depends on. They are converted by ``repr``."""
+        from . import __version__
+        hash_ = blake2b(digest_size=_DIGEST_SIZE)
+        hash_.update(MAGIC_NUMBER)
+        for part in (__version__, *parts):
+            data = repr(part).encode()
+            hash_.update(len(data).to_bytes(8, "little"))
+            hash_.update(data)
+        return hash_.digest()
+
+    def _get_path(self, key: bytes) -> str:
+        return os.path.join(self.directory, f"{key.hex()}.mikoc")
+
+    def load(self, key: bytes) -> Any:
+        """Load the data of the key.
+        If there is no file or the file is broken, ``None`` is returned."""
+        try:
+            with open(self._get_path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        # ヘッダーを確認して、壊れていたりしたら無視する。
+        if len(data) < _HEADER_SIZE or not data.startswith(MAGIC_NUMBER) \
+                or data[len(MAGIC_NUMBER):len(MAGIC_NUMBER) + _DIGEST_SIZE] != key:
+            return None
+        body = data[_HEADER_SIZE:]
+        if blake2b(body, digest_size=_DIGEST_SIZE).digest() != data[
+            len(MAGIC_NUMBER) + _DIGEST_SIZE:_HEADER_SIZE
+        ]:
+            return None
+        try:
+            return marshal.loads(body)
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def dump(self, key: bytes, value: Any) -> None:
+        """Store the data of the key.
+        The value must be able to be marshalled. If the file cannot be written, nothing happens."""
+        body = marshal.dumps(value)
+        data = b"".join((
+            MAGIC_NUMBER, key, blake2b(body, digest_size=_DIGEST_SIZE).digest(),
+            body
+        ))
+        try:
+            descriptor, temporary = mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                f.write(data)
+            os.replace(temporary, self._get_path(key))
+        except OSError:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        "Remove all the files in the directory."
+        for name in os.listdir(self.directory):
+            if name.endswith((".mikoc", ".tmp")):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
@@ -0,0 +1,466 @@
+# miko - Compiler
+
+from __future__ import annotations
+
+from collections.abc import Iterable
+from types import CodeType
+
+from inspect import cleandoc
+from html import escape
+import ast
+import re
+
+from .parser import Segment
+
+
+__all__ = (
+    "RENDER_FUNCTION_NAME", "CHUNKS_FUNCTION_NAME", "ASYNC_CHUNKS_FUNCTION_NAME",
+    "ESCAPE_FUNCTION_NAME",
+    "DYNAMIC_NAMES", "parse_block", "collect_names", "collect_free_names", "fold_constant",
+    "minify_whitespace", "compile_template"
+)
+
+
+RENDER_FUNCTION_NAME = "__miko_render"
+"The name of the function that renders a whole template in the compiled code."
+_BLOCK_FUNCTION_NAME = "__miko_block_{}"
+_KWARGS_NAME = "__miko_kwargs"
+CHUNKS_FUNCTION_NAME = "__miko_chunks"
+"The name of the function which splits the value of a block into chunks in the streaming code. It must be in the globals of the code."
+ASYNC_CHUNKS_FUNCTION_NAME = "__miko_achunks"
+"The name of the asynchronous generator function used instead of :data:`CHUNKS_FUNCTION_NAME` in the asynchronous streaming code."
+_CHUNK_NAME = "__miko_chunk"
+ESCAPE_FUNCTION_NAME = "__miko_escape"
+"The name of the function which converts the value of a block into an escaped string in the code compiled with ``autoescape``. It must be in the globals of the code."
+DYNAMIC_NAMES = frozenset(("locals", "vars", "eval", "exec", "dir"))
+"If a block uses one of these names, all the values passed to the template are passed to the block because they may be looked up dynamically."
+
+
+# 位置を持つノード。
+_LOCATED_NODES = (
+    ast.expr, ast.stmt, ast.excepthandler, ast.arg, ast.keyword, ast.alias, ast.pattern
+)
+
+
+def parse_block(
+    text: str, line: int = 1, column: int = 0, path: str = "unknown"
+) -> list[ast.stmt]:
+    """Parse the code of a block.
+    The indentation of the code is removed, and if the last statement is an expression, it is replaced by ``return``.
+
+    Parameters
+    ----------
+    text : str
+        The string of the block.
+    line : int, default 1
+        The line number in the template where the string of the block starts.
+    column : int, default 0
+        The column offset in the template where the string of the block starts.
+    path : str, default "unknown"
+        The path to the template file. This is used for syntax errors.
+
+    Returns
+    -------
+    list[ast.stmt]
+        The statements of the block.
+        Their locations point to the position in the template, not in the block."""
+    rows = text.expandtabs().splitlines()
+    # `cleandoc`で消える最初の空行の数と各行のインデントを調べて、位置をテンプレート内でのものに直す。
+    skipped = 0
+    while skipped < len(rows) and not rows[skipped].strip():
+        skipped += 1
+    margin = min((
+        len(row) - len(row.lstrip()) for row in rows[1:] if row.strip()
+    ), default=0)
+    first = column + len(rows[0]) - len(rows[0].lstrip()) if rows else column
+    try:
+        body = ast.parse(cleandoc(text), path).body
+    except SyntaxError as error:
+        if error.lineno is not None:
+            # 列もノードと同じようにずらし、表示される行をテンプレートでの行にする。
+            row = error.lineno - 1 + skipped
+            shift = first if row == 0 else margin
+            if error.offset is not None:
+                error.offset += shift
+            if error.end_offset is not None and error.end_lineno is not None:
+                error.end_offset += first if error.end_lineno - 1 + skipped == 0 else margin
+            if row < len(rows):
+                error.text = " " * column + rows[row] + "\n" if row == 0 else rows[row] + "\n"
+            error.lineno += line - 1 + skipped
+            if error.end_lineno is not None:
+                error.end_lineno += line - 1 + skipped
+        raise
+    for statement in body:
+        for node in ast.walk(statement):
+            if not isinstance(node, _LOCATED_NODES):
+                continue
+            node.col_offset += first if node.lineno + skipped == 1 else margin
+            if node.end_col_offset is not None and node.end_lineno is not None:
+                node.end_col_offset += first \
+                    if node.end_lineno + skipped == 1 else margin
+    for statement in body:
+        ast.increment_lineno(statement, line - 1 + skipped)
+    # `^^ user.name ^^`のようにテンプレートに文字列を配置できるようにするためにもし最後に`return`がなければ配置する。
+    if body and isinstance(body[-1], ast.Expr):
+        last = body.pop(-1)
+        body.append(ast.copy_location(ast.Return(last.value), last)) # type: ignore
+    return body
+
+
+def _block_names(body: list[ast.stmt]) -> frozenset[str] | None:
+    # ブロックで使われている名前を全て集める。代入されているだけの名前も含めるので、渡されても問題はない。
+    names = frozenset(
+        node.id for statement in body for node in ast.walk(statement)
+        if isinstance(node, ast.Name)
+    )
+    return None if names & DYNAMIC_NAMES else names
+
+
+def collect_names(
+    segments: Iterable[Segment], path: str = "unknown"
+) -> frozenset[str] | None:
+    """Collect the names used in the blocks of a template.
+
+    Parameters
+    ----------
+    segments : Iterable[Segment]
+        The segments of the template yielded by :func:`miko.parser.tokenize`.
+    path : str, default "unknown"
+        The path to the template file. This is used for syntax errors.
+
+    Returns
+    -------
+    frozenset[str] | None
+        The names. Only the values of these names need to be passed to the compiled function.  
+        If a block uses a name in :data:`DYNAMIC_NAMES`, ``None`` is returned, which means that all values should be passed."""
+    names: set[str] = set()
+    for _, is_block, text, line, column in segments:
+        if is_block:
+            block_names = _block_names(parse_block(text, line, column, path))
+            if block_names is None:
+                return None
+            names.update(block_names)
+    return frozenset(names)
+
+
+def _bound_names(body: list[ast.stmt]) -> set[str]:
+    # ブロックの中で束縛される名前を集める。内包表記の変数や関数の引数なども含む。
+    names: set[str] = set()
+    for statement in body:
+        for node in ast.walk(statement):
+            if isinstance(node, ast.Name):
+                if not isinstance(node.ctx, ast.Load):
+                    names.add(node.id)
+            elif isinstance(node, ast.arg):
+                names.add(node.arg)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                names.add(node.name)
+            elif isinstance(node, ast.alias):
+                names.add((node.asname or node.name).split(".")[0])
+            elif isinstance(node, ast.ExceptHandler) and node.name is not None:
+                names.add(node.name)
+            elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name is not None:
+                names.add(node.name)
+            elif isinstance(node, ast.MatchMapping) and node.rest is not None:
+                names.add(node.rest)
+    return names
+
+
+def collect_free_names(
+    segments: Iterable[Segment], path: str = "unknown"
+) -> frozenset[str] | None:
+    """Collect the names which the blocks of a template read but do not bind.
+    Unlike :func:`collect_names`, the names only assigned in a block, such as the variables of ``for`` and comprehensions, are not included.
+
+    Parameters
+    ----------
+    segments : Iterable[Segment]
+        The segments of the template yielded by :func:`miko.parser.tokenize`.
+    path : str, default "unknown"
+        The path to the template file. This is used for syntax errors.
+
+    Returns
+    -------
+    frozenset[str] | None
+        The names. If a block uses a name in :data:`DYNAMIC_NAMES`, ``None`` is returned."""
+    names: set[str] = set()
+    for _, is_block, text, line, column in segments:
+        if is_block:
+            body = parse_block(text, line, column, path)
+            if _block_names(body) is None:
+                return None
+            # ブロックは別々の関数になるので、束縛される名前はブロックごとに除く。
+            names.update({
+                node.id for statement in body for node in ast.walk(statement)
+                if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)
+            } - _bound_names(body))
+    return frozenset(names)
+
+
+def _is_inlinable(body: list[ast.stmt]) -> bool:
+    # `return 式`だけのブロックで、名前を束縛したりジェネレータにしたりしないものは関数にせず埋め込める。
+    return len(body) == 1 and isinstance(body[0], ast.Return) \
+        and body[0].value is not None and not any(
+            isinstance(node, (ast.NamedExpr, ast.Yield, ast.YieldFrom))
+            for node in ast.walk(body[0].value)
+        )
+
+
+# タプルは`stream`で要素ごとに出力されるので、文字列にしてしまわないように畳み込まない。
+_FOLDABLE_NODES = (
+    ast.Constant, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+    ast.JoinedStr, ast.FormattedValue, ast.operator, ast.unaryop,
+    ast.boolop, ast.cmpop, ast.expr_context
+)
+# 巨大な値を作れてしまう演算は畳み込まない。
+_UNFOLDABLE_OPERATORS = (ast.Mult, ast.Pow, ast.LShift)
+
+
+def fold_constant(value: ast.expr) -> str | None:
+    """Evaluate the expression of a block at compile time if it consists of only literals and operators, such as ``"<br>"`` or ``1 + 2``.
+    Such an expression has no side effects, so the result can be placed as static text.
+
+    Parameters
+    ----------
+    value : ast.expr
+        The expression.
+
+    Returns
+    -------
+    str | None
+        The string of the value. If the expression cannot be evaluated at compile time, ``None`` is returned.
+
+    Notes
+    -----
+    Names are never evaluated because the builtins and the values passed to the template may change them.  
+    Multiplication, power and left shift are not evaluated because they can make a huge value, and an expression that raises an error is left as it is so that the error occurs when rendering."""
+    for node in ast.walk(value):
+        if not isinstance(node, _FOLDABLE_NODES) or isinstance(node, _UNFOLDABLE_OPERATORS):
+            return None
+    try:
+        return str(eval(
+            compile(ast.Expression(body=value), "<miko>", "eval"),
+            {"__builtins__": {}}
+        ))
+    except Exception:
+        return None
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def minify_whitespace(text: str) -> str:
+    """Collapse whitespace in static text.
+    A run of whitespace becomes a newline if it contains a newline, otherwise it becomes a space.
+
+    Notes
+    -----
+    Do not use this for the text whose whitespace matters, such as the content of ``<pre>`` in HTML."""
+    return _WHITESPACE.sub(
+        lambda match: "\n" if "\n" in match.group() else " ", text
+    )
+
+
+def _merge_static(parts: list[tuple[bool, ast.expr]]) -> list[tuple[bool, ast.expr]]:
+    # 隣り合った静的な文字列を一つにまとめる。
+    merged: list[tuple[bool, ast.expr]] = []
+    for is_block, part in parts:
+        if not is_block and merged and not merged[-1][0]:
+            merged[-1] = (False, ast.Constant(
+                value=merged[-1][1].value + part.value # type: ignore
+            ))
+        else:
+            merged.append((is_block, part))
+    return merged
+
+
+def _make_arguments(
+    args: Iterable[str], kwarg: str | None = None
+) -> ast.arguments:
+    return ast.arguments(
+        posonlyargs=[], args=[ast.arg(arg=arg) for arg in args],
+        vararg=None, kwonlyargs=[], kw_defaults=[],
+        kwarg=None if kwarg is None else ast.arg(arg=kwarg), defaults=[]
+    )
+
+
+def _make_function(
+    name: str, args: tuple[str, ...], body: list[ast.stmt],
+    async_function: bool, kwarg: str | None = None
+) -> ast.FunctionDef | ast.AsyncFunctionDef:
+    return (ast.AsyncFunctionDef if async_function else ast.FunctionDef)(
+        name=name, args=_make_arguments(args, kwarg), body=body,
+        decorator_list=[], returns=None, type_comment=None
+    )
+
+
+def _make_escape(part: ast.expr) -> ast.expr:
+    return ast.copy_location(ast.Call(
+        func=ast.Name(id=ESCAPE_FUNCTION_NAME, ctx=ast.Load()),
+        args=[part], keywords=[]
+    ), part)
+
+
+def _make_render_body(
+    parts: list[tuple[bool, ast.expr]], autoescape: bool = False
+) -> list[ast.stmt]:
+    # 全てを一つのフォーマット済み文字列で連結する。エスケープする場合は、エスケープする関数が文字列を返すので変換しない。
+    return [ast.Return(value=ast.JoinedStr(values=[
+        part if not is_block else ast.copy_location(
+            ast.FormattedValue(
+                value=_make_escape(part), conversion=-1, format_spec=None
+            ) if autoescape else ast.FormattedValue(
+                value=part, conversion=ord("s"), format_spec=None
+            ), part
+        ) for is_block, part in parts
+    ]))]
+
+
+def _make_chunks(
+    part: ast.expr, async_function: bool, autoescape: bool = False
+) -> ast.stmt:
+    args = [part]
+    if autoescape:
+        args.append(ast.Name(id=ESCAPE_FUNCTION_NAME, ctx=ast.Load()))
+    if not async_function:
+        return ast.Expr(value=ast.YieldFrom(value=ast.Call(
+            func=ast.Name(id=CHUNKS_FUNCTION_NAME, ctx=ast.Load()),
+            args=args, keywords=[]
+        )))
+    # 非同期ジェネレータでは`yield from`が使えないので`async for`を使う。
+    return ast.AsyncFor(
+        target=ast.Name(id=_CHUNK_NAME, ctx=ast.Store()),
+        iter=ast.Call(
+            func=ast.Name(id=ASYNC_CHUNKS_FUNCTION_NAME, ctx=ast.Load()),
+            args=args, keywords=[]
+        ),
+        body=[ast.Expr(value=ast.Yield(
+            value=ast.Name(id=_CHUNK_NAME, ctx=ast.Load())
+        ))],
+        orelse=[], type_comment=None
+    )
+
+
+def _make_stream_body(
+    parts: list[tuple[bool, ast.expr]], async_function: bool = False,
+    autoescape: bool = False
+) -> list[ast.stmt]:
+    # 静的な文字列はそのまま、ブロックの値は分割してyieldする。
+    body: list[ast.stmt] = [
+        ast.Expr(value=ast.Yield(value=part)) if not is_block else
+        ast.copy_location(_make_chunks(part, async_function, autoescape), part)
+        for is_block, part in parts
+    ]
+    # 何もない場合でもジェネレータになるようにする。
+    return body or [ast.Return(value=None), ast.Expr(value=ast.Yield(value=None))]
+
+
+def compile_template(
+    segments: Iterable[Segment], args: tuple[str, ...],
+    path: str = "unknown", async_function: bool = False, stream: bool = False,
+    split: bool = False, minify: bool = False, autoescape: bool = False
+) -> CodeType:
+    """Compile a whole template into one code object.
+    When the code is executed, it defines a function named :data:`RENDER_FUNCTION_NAME` which takes ``args`` and returns the rendered text.  
+    The function also accepts other keyword arguments and ignores them.
+
+    Parameters
+    ----------
+    segments : Iterable[Segment]
+        The segments of the template yielded by :func:`miko.parser.tokenize`.
+    args : tuple[str, ...]
+        A tuple of the names of the values that would be passed to the template.  
+        Only the names returned by :func:`collect_names` need to be included.
+    path : str, default "unknown"
+        The path to the template file.
+        It is used for the file name of the code, and the line numbers of the code point to the lines in the template.
+        So the traceback of an error in a block shows where it is in the template.
+    async_function : bool, default False
+        Whether or not to make the function an asynchronous function.
+    stream : bool, default False
+        Whether to make the function a generator which yields the static text and the values of the blocks in order instead of joining them.  
+        The value of each block is passed to the function named :data:`CHUNKS_FUNCTION_NAME` and the chunks returned by it are yielded.  
+        If ``async_function`` is also ``True``, the function becomes an asynchronous generator and :data:`ASYNC_CHUNKS_FUNCTION_NAME` is used instead.
+    split : bool, default False
+        Whether to make the function return a tuple of the parts of the template without calling the blocks.  
+        Static text is a string and a block is a tuple of its number, its function and the arguments for the function.  
+        The function itself is not asynchronous even if ``async_function`` is ``True``, but the functions of the blocks are.  
+        This is used to call the blocks one by one, for example, to run them concurrently.
+    minify : bool, default False
+        Whether to collapse whitespace in static text by :func:`minify_whitespace`.
+    autoescape : bool, default False
+        Whether to escape the values of the blocks by the function named :data:`ESCAPE_FUNCTION_NAME`.  
+        In the streaming code, it is passed to the function named :data:`CHUNKS_FUNCTION_NAME` or :data:`ASYNC_CHUNKS_FUNCTION_NAME` as the second argument.  
+        In the split code, the values are not escaped, so the caller must escape them.
+
+    Notes
+    -----
+    Static text is placed as constants, and blocks consisting of only one expression are embedded as they are.  
+    A block whose expression can be evaluated by :func:`fold_constant` is placed as static text, and adjacent static text is joined.
+    Other blocks become functions that are called from the render function.  
+    Those functions take only the values of the names that they use.
+    All of them are joined at once by a formatted string."""
+    module: list[ast.stmt] = []
+    parts: list[tuple[bool, ast.expr]] = []
+    for index, is_block, text, line, column in segments:
+        if not is_block:
+            if text:
+                parts.append((False, ast.Constant(
+                    value=minify_whitespace(text) if minify else text
+                )))
+            continue
+        body = parse_block(text, line, column, path)
+        if not body:
+            continue
+        if _is_inlinable(body):
+            folded = fold_constant(body[0].value) # type: ignore
+            if folded is not None:
+                if folded:
+                    parts.append((False, ast.Constant(
+                        value=escape(folded) if autoescape else folded
+                    )))
+                continue
+        if _is_inlinable(body) and not split:
+            value = body[0].value # type: ignore
+        else:
+            # 文があるブロックは関数にして、描画用の関数から呼び出す。
+            name = _BLOCK_FUNCTION_NAME.format(index)
+            block_names = _block_names(body)
+            block_args = args if block_names is None \
+                else tuple(arg for arg in args if arg in block_names)
+            module.append(_make_function(name, block_args, body, async_function))
+            arguments: list[ast.expr] = [
+                ast.Name(id=arg, ctx=ast.Load()) for arg in block_args
+            ]
+            if split:
+                value = ast.Tuple(elts=[
+                    ast.Constant(value=index), ast.Name(id=name, ctx=ast.Load()),
+                    ast.Tuple(elts=arguments, ctx=ast.Load())
+                ], ctx=ast.Load())
+            else:
+                value = ast.Call(
+                    func=ast.Name(id=name, ctx=ast.Load()),
+                    args=arguments, keywords=[]
+                )
+                if async_function:
+                    value = ast.Await(value=value)
+            for node in ast.walk(value):
+                ast.copy_location(node, body[0])
+        parts.append((True, value))
+    parts = _merge_static(parts)
+    if split:
+        module.append(_make_function(
+            RENDER_FUNCTION_NAME, args, [ast.Return(value=ast.Tuple(
+                elts=[part for _, part in parts], ctx=ast.Load()
+            ))], False, _KWARGS_NAME
+        ))
+    else:
+        module.append(_make_function(
+            RENDER_FUNCTION_NAME, args,
+            _make_stream_body(parts, async_function, autoescape) if stream
+                else _make_render_body(parts, autoescape),
+            async_function, _KWARGS_NAME
+        ))
+    tree = ast.Module(body=module, type_ignores=[])
+    ast.fix_missing_locations(tree)
+    return compile(tree, path, "exec")
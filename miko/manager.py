@@ -2,7 +2,98 @@
 
 from __future__ import annotations
 
+from typing import NamedTuple
+from collections.abc import Callable, Iterable, Iterator, AsyncIterator
+from dataclasses import dataclass, field
+
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from collections import deque
+from itertools import islice
+from time import perf_counter, monotonic
+from glob import glob
+import pickle
+import os
+
 from .template import Template, Any
+from .builtins import include, aioinclude, track_dependencies, _record_dependency
+from .utils import LRUCache, DependencyGraph
+
+
+__all__ = ("PreloadReport", "RenderResult", "Manager")
+
+
+@dataclass
+class PreloadReport:
+    "The result of :meth:`miko.manager.Manager.preload`."
+
+    templates: int = 0
+    "The number of the templates compiled."
+    blocks: int = 0
+    "The number of the blocks in the compiled templates."
+    functions: int = 0
+    "The number of the functions prepared. A template has one function for each signature."
+    seconds: float = 0.0
+    "How long it took."
+    errors: dict[str, Exception] = field(default_factory=dict)
+    "The paths of the templates that could not be compiled and the errors."
+
+    def __str__(self) -> str:
+        return "{} templates ({} blocks, {} functions) in {:.3f}s{}".format(
+            self.templates, self.blocks, self.functions, self.seconds,
+            "".join(
+                f"\n{path}: {error.__class__.__name__}: {error}"
+                for path, error in self.errors.items()
+            )
+        )
+
+
+class RenderResult(NamedTuple):
+    "The result of a job of :meth:`miko.manager.Manager.render_parallel`."
+
+    index: int # type: ignore[assignment]
+    "The number of the job in the passed jobs."
+    output: str | None
+    "The rendered text, or the path to the file if the job has it. If an error occurred, it is ``None``."
+    error: Exception | None = None
+    "The error that occurred while rendering. It is set only when ``raise_errors`` is ``False``."
+
+
+# 子プロセスで使うマネージャー。
+_worker_manager: Manager | None = None
+
+
+def _initialize_worker(factory):
+    global _worker_manager
+    _worker_manager = factory if isinstance(factory, Manager) else factory()
+
+
+def _render_jobs(jobs):
+    assert _worker_manager is not None
+    results = []
+    for index, (path, context, *destination) in jobs:
+        try:
+            output = _worker_manager.render(path, **context)
+            if destination and destination[0] is not None:
+                directory = os.path.dirname(destination[0])
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(destination[0], "w") as f:
+                    f.write(output)
+                output = destination[0]
+        except Exception as error:
+            # 親プロセスに送れないエラーは、内容がわかるように別のエラーにする。
+            try:
+                pickle.dumps(error)
+            except Exception:
+                error = RuntimeError(f"{error.__class__.__name__}: {error}")
+            results.append(RenderResult(index, None, error))
+        else:
+            results.append(RenderResult(index, output))
+    return results
+
+
+def _rebuild_manager(cls, args, options):
+    return cls(*args, **options)
 
 
 class Manager:
@@ -20,15 +111,72 @@ class Manager:
         A dictionary of names and values of attributes to be attached to a :class:`miko.template.Template` class when it is instantiated.  
         This makes it easy to extend :class:`miko.template.Template` and access its attributes from within a template via its instance.  
         For example, if you put an instance of a web framework class as ``{\"app\": app}``, you can access ``self.app`` and its object in the template.
+    reload_interval : float | None, default 0.0
+        How often to check whether the file of a cached template has been changed, in seconds.  
+        If it is ``0``, it is checked every time the template is got. If it is ``None``, it is never checked, which is good for production.
+    max_templates : int | None, default 1024
+        The maximum number of the cached templates. If it is ``None``, there is no limit.
+    memoize : bool, default False
+        Whether to cache the outputs of :meth:`miko.manager.Manager.render` and :meth:`miko.manager.Manager.aiorender`.  
+        The key of an output is the path, the content of the template and the passed values, so the values must be hashable.  
+        If they are not hashable, the template is rendered as usual.  
+        Only use this if the output of the templates depends on nothing but the passed values.  
+        The files used by ``self.extends`` or ``include`` in the rendering are recorded, and they are checked according to ``reload_interval`` like the templates.
+    max_outputs : int | None, default 1024
+        The maximum number of the cached outputs. If it is ``None``, there is no limit.
+    max_output_bytes : int | None, default None
+        The maximum total length of the cached outputs. If it is ``None``, there is no limit.
     **kwargs
-        Keyword arguments to pass to :class:`miko.template.Template`."""
+        Keyword arguments to pass to :class:`miko.template.Template`.
+
+    Attributes
+    ----------
+    templates : LRUCache[tuple, list]
+        The cache of the templates.  
+        The keys are tuples of the path and the options, and the values are lists of the template and the time when it was checked.
+    memoize : bool
+    outputs : LRUCache[tuple, list]
+        The cache of the outputs used when ``memoize`` is ``True``. Its ``stats`` has the numbers of hits and misses.  
+        The values are lists of the output, the paths and contents of the files used and the time when they were checked.
+    instrument : Instrument | None
+        The ``instrument`` passed to :class:`miko.template.Template`. The misses of the caches of this class are also told to it.
+    dependencies : DependencyGraph
+        The files used by each template through ``self.extends``, ``self.aioextends`` and ``include``.  
+        When a file is changed, the cached outputs of the templates which use it are removed.
+
+    Notes
+    -----
+    The templates are cached and the copies of them made by :meth:`miko.template.Template.copy` are returned by :meth:`miko.manager.Manager.get_template`.  
+    So the files are not parsed and the functions are not prepared for every rendering, and attributes set to ``self`` in a block are not shared with other renderings."""
 
     def __init__(
         self, *args, template_cls: type[Template] = Template,
-        extends: dict[str, Any] | None = None, **kwargs
+        extends: dict[str, Any] | None = None,
+        reload_interval: float | None = 0.0, max_templates: int | None = 1024,
+        memoize: bool = False, max_outputs: int | None = 1024,
+        max_output_bytes: int | None = None, **kwargs
     ):
         self.args, self.kwargs, self.template_cls = args, kwargs, template_cls
         self.extends = extends or {}
+        self.reload_interval = reload_interval
+        self.templates: LRUCache[tuple, list] = LRUCache(max_templates)
+        self.memoize = memoize
+        self.outputs: LRUCache[tuple, list] = LRUCache(max_outputs, max_output_bytes)
+        self.dependencies = DependencyGraph()
+        self.instrument = kwargs.get("instrument")
+
+    def __reduce__(self):
+        # キャッシュは送らず、今の設定で作り直す。`extends`などは作った後に変更されることがあるので、引数ではなく属性を使う。
+        # 計測は別のプロセスから戻せず、ロックを持っていて送れないことも多いので、`instrument`は渡さない。
+        kwargs = self.kwargs.copy()
+        kwargs.pop("instrument", None)
+        return _rebuild_manager, (self.__class__, self.args, dict(
+            template_cls=self.template_cls, extends=self.extends,
+            reload_interval=self.reload_interval,
+            max_templates=self.templates.max_entries, memoize=self.memoize,
+            max_outputs=self.outputs.max_entries,
+            max_output_bytes=self.outputs.max_bytes, **kwargs
+        ))
 
     def _prepare_template(self, template):
         template.manager = self
@@ -36,6 +184,120 @@ class Manager:
             for key, value in self.extends.items():
                 setattr(template, key, value)
 
+    def _get_key(self, path, args, kwargs):
+        # オプションの値がハッシュ可能でない場合は`id`を使う。キャッシュされたテンプレートが値を持っているので`id`は変わらない。
+        if not args and not kwargs:
+            return (path, None)
+        return (path, tuple(
+            (name, value if getattr(value, "__hash__", None) else id(value))
+            for name, value in (*enumerate(args), *sorted(kwargs.items()))
+        ))
+
+    def _get_cached(self, key):
+        # キャッシュされたテンプレートと、ファイルを確認する必要があるかどうかを返す。
+        entry = self.templates.get(key)
+        if entry is None:
+            return None, False
+        return entry, self.reload_interval is not None \
+            and monotonic() - entry[1] >= self.reload_interval
+
+    def _store(self, key, template):
+        self._prepare_template(template)
+        template._check_source()
+        self.templates.set(key, [template, monotonic()])
+        return self._copy(template)
+
+    def _copy(self, template):
+        template = template.copy()
+        self._prepare_template(template)
+        return template
+
+    def _get_output_key(self, path, template, kwargs):
+        # 値の型も含めて、`True`と`1`のように等しいが異なる出力になる値を区別する。
+        try:
+            key = (path, template.template, frozenset(
+                (name, value.__class__, value) for name, value in kwargs.items()
+            ))
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _invalidate_dependents(self, path):
+        # 変更されたファイルを使うテンプレートの出力だけを消す。コンパイルされた関数はそのファイルの内容に依存しないので消さない。
+        paths = self.dependencies.get_dependents(path)
+        paths.add(path)
+        self.outputs.discard(lambda key: key[0] in paths)
+        self.dependencies.remove(path)
+
+    def _store_output(self, key, output, dependencies):
+        for dependency in dependencies:
+            self.dependencies.add(key[0], dependency)
+        self.outputs.set(
+            key, [output, tuple(dependencies.items()), monotonic()], len(output)
+        )
+
+    def _count_stale_output(self, key):
+        # `get`はヒットとして数えているので、古かった出力はミスとして数え直す。
+        with self.outputs.lock:
+            self.outputs.stats.hits -= 1
+            self.outputs.stats.misses += 1
+        if self.instrument is not None:
+            self.instrument.on_cache_miss(key[0], "output")
+
+    def _get_output(self, key):
+        # 出力のキャッシュを取得する。使ったファイルが変更されていれば`None`を返す。
+        entry = self.outputs.get(key)
+        if entry is None:
+            if self.instrument is not None:
+                self.instrument.on_cache_miss(key[0], "output")
+            return None
+        if self.reload_interval is not None \
+                and monotonic() - entry[2] >= self.reload_interval:
+            for path, text in entry[1]:
+                if include(path) is not text:
+                    self._invalidate_dependents(path)
+                    self._count_stale_output(key)
+                    return None
+            entry[2] = monotonic()
+        for path, text in entry[1]:
+            _record_dependency(path, text)
+        return entry[0]
+
+    async def _aio_get_output(self, key):
+        entry = self.outputs.get(key)
+        if entry is None:
+            if self.instrument is not None:
+                self.instrument.on_cache_miss(key[0], "output")
+            return None
+        if self.reload_interval is not None \
+                and monotonic() - entry[2] >= self.reload_interval:
+            for path, text in entry[1]:
+                if await aioinclude(path) is not text:
+                    self._invalidate_dependents(path)
+                    self._count_stale_output(key)
+                    return None
+            entry[2] = monotonic()
+        for path, text in entry[1]:
+            _record_dependency(path, text)
+        return entry[0]
+
+    def clear(self, path: str | None = None) -> None:
+        """Remove the cached templates and outputs.
+
+        Parameters
+        ----------
+        path : str | None, default None
+            The path of the template. If it is ``None``, all templates are removed.  
+            The cached outputs of the templates which use the file of the path are also removed."""
+        if path is None:
+            self.templates.clear()
+            self.outputs.clear()
+            self.dependencies.clear()
+        else:
+            self.templates.discard(lambda key: key[0] == path)
+            self._invalidate_dependents(path)
+
     def get_template(self, path: str, *args, **kwargs: dict) -> Template:
         """Prepare template from file.
 
@@ -52,12 +314,24 @@ class Manager:
 
         Notes
         -----
-        The class of the ``template_cls`` argument passed to :class:`miko.manager.Manager` will be used to create an instance of ``Template``."""
-        template = self.template_cls.from_file(
+        The class of the ``template_cls`` argument passed to :class:`miko.manager.Manager` will be used to create an instance of ``Template``.  
+        The template is cached, and whether the file has been changed is checked according to ``reload_interval``."""
+        key = self._get_key(path, args, kwargs)
+        entry, check = self._get_cached(key)
+        if entry is not None:
+            # `include`はファイルの更新日時を見てキャッシュするので、変更されていなければ同じ文字列が返される。
+            if check and include(path) is not entry[0].template:
+                self._invalidate_dependents(path)
+            else:
+                if check:
+                    entry[1] = monotonic()
+                _record_dependency(path, entry[0].template)
+                return self._copy(entry[0])
+        if self.instrument is not None:
+            self.instrument.on_cache_miss(path, "template")
+        return self._store(key, self.template_cls.from_file(
             path, *(args or self.args), **(kwargs or self.kwargs)
-        )
-        self._prepare_template(template)
-        return template
+        ))
 
     async def aio_get_template(self, path: str, *args, **kwargs) -> Template:
         """This is an asynchronous version of version for :meth:`miko.manager.Manager.get_template`.
@@ -72,11 +346,21 @@ class Manager:
         **kwargs
             Keyword arguments to pass to :meth:`miko.template.Template.aio_from_file`.  
             By default, ``kwargs`` passed when you instantiate this class is used."""
-        template = await self.template_cls.aio_from_file(
+        key = self._get_key(path, args, kwargs)
+        entry, check = self._get_cached(key)
+        if entry is not None:
+            if check and await aioinclude(path) is not entry[0].template:
+                self._invalidate_dependents(path)
+            else:
+                if check:
+                    entry[1] = monotonic()
+                _record_dependency(path, entry[0].template)
+                return self._copy(entry[0])
+        if self.instrument is not None:
+            self.instrument.on_cache_miss(path, "template")
+        return self._store(key, await self.template_cls.aio_from_file(
             path, *(args or self.args), **(kwargs or self.kwargs)
-        )
-        self._prepare_template(template)
-        return template
+        ))
 
     def render(self, path: str, **kwargs) -> str:
         """Render the file from the template.
@@ -108,7 +392,208 @@ class Manager:
           :caption: Backend
 
           manager.render("template.html", title=title)"""
-        return self.get_template(path).render(**kwargs)
+        template = self.get_template(path)
+        if not self.memoize:
+            return template.render(**kwargs)
+        key = self._get_output_key(path, template, kwargs)
+        if key is None:
+            return template.render(**kwargs)
+        output = self._get_output(key)
+        if output is None:
+            with track_dependencies() as dependencies:
+                output = template.render(**kwargs)
+            self._store_output(key, output, dependencies)
+        return output
+
+    def render_many(
+        self, path: str, contexts: Iterable[dict[str, Any]], **kwargs
+    ) -> Iterator[str]:
+        """Render the file for each of the contexts.
+        The template is got only once, and each context is rendered with a copy of it like :meth:`miko.manager.Manager.render`. (See :meth:`miko.template.Template.render_many`)
+
+        Parameters
+        ----------
+        path : str
+            The path to the file.
+        contexts : Iterable[dict[str, Any]]
+            The values to pass to the template for each rendering.
+        **kwargs
+            The values passed to all the renderings."""
+        template = self.get_template(path)
+        return template._render_many(contexts, True, kwargs, True)
+
+    def render_to(self, path: str, fp: Any, **kwargs) -> int:
+        """Render the file and write it to a file-like object. (See :meth:`miko.template.Template.render_to`)
+
+        Parameters
+        ----------
+        path : str
+            The path to the file.
+        fp : Any
+            The file-like object.
+        **kwargs
+            The keyword arguments to pass to :meth:`miko.template.Template.render_to`."""
+        return self.get_template(path).render_to(fp, **kwargs)
+
+    async def aiorender_to(self, path: str, fp: Any, **kwargs) -> int:
+        """This is an asynchronous version of :meth:`miko.manager.Manager.render_to`.
+
+        Parameters
+        ----------
+        path : str
+            The path to the file.
+        fp : Any
+            The file-like object.
+        **kwargs
+            The keyword arguments to pass to :meth:`miko.template.Template.aiorender_to`."""
+        return await (await self.aio_get_template(path)).aiorender_to(fp, **kwargs)
+
+    def render_parallel(
+        self, jobs: Iterable[tuple[str, dict[str, Any]] | tuple[str, dict[str, Any], str | None]],
+        workers: int | None = None, chunksize: int = 1, ordered: bool = True,
+        raise_errors: bool = True, factory: Callable[[], Manager] | None = None
+    ) -> Iterator[RenderResult]:
+        """Render many files in other processes to use multiple CPU cores.  
+        Each job is a tuple of the path, the values passed to the template and optionally the path of the file where the output is written.  
+        If the output is written to a file, the rendered text is not sent back to this process.
+
+        Parameters
+        ----------
+        jobs : Iterable[tuple[str, dict[str, Any]] | tuple[str, dict[str, Any], str | None]]
+            The jobs. They are read little by little, so it can be a generator of many jobs.
+        workers : int | None, default None
+            The number of the processes. If it is ``None``, it is the number of the CPUs.
+        chunksize : int, default 1
+            The number of the jobs sent to a process at once. Make it larger if there are many small jobs.
+        ordered : bool, default True
+            Whether to yield the results in the order of the jobs. If it is ``False``, they are yielded as soon as they are done.
+        raise_errors : bool, default True
+            Whether to raise an error that occurred in a job. If it is ``False``, it is set to :attr:`miko.manager.RenderResult.error`.
+        factory : Callable[[], Manager] | None, default None
+            The function that makes the manager in each process. It must be able to be pickled, such as a function defined at the top level of a module.  
+            If it is ``None``, the manager is made with the same arguments as this one, so the values of ``extends`` must be able to be pickled.  
+            In that case ``instrument`` is not passed to the processes, and ``cache_manager`` is made again with the same options but without the cached values.
+
+        Yields
+        ------
+        RenderResult
+            The results of the jobs.
+
+        Notes
+        -----
+        The values passed to the templates must be able to be pickled.  
+        On the platforms where processes are forked, the templates compiled in this process by :meth:`miko.manager.Manager.preload` are shared with the processes.  
+        Otherwise, use :class:`miko.bytecode.BytecodeCache` so that they are not compiled in each process."""
+        numbered, workers = iter(enumerate(jobs)), workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(
+            workers, initializer=_initialize_worker,
+            initargs=(self if factory is None else factory,)
+        ) as executor:
+            # 全ての仕事を一度に送るとメモリを使うので、プロセスの数の二倍ずつ送る。
+            limit = 2 * workers
+            pending: deque[Future] = deque()
+
+            def submit():
+                chunk = list(islice(numbered, chunksize))
+                if chunk:
+                    pending.append(executor.submit(_render_jobs, chunk))
+                return bool(chunk)
+
+            while len(pending) < limit and submit():
+                pass
+            try:
+                while pending:
+                    if ordered:
+                        future = pending.popleft()
+                    else:
+                        future = next(iter(wait(pending, return_when=FIRST_COMPLETED).done))
+                        pending.remove(future)
+                    submit()
+                    for result in future.result():
+                        if raise_errors and result.error is not None:
+                            raise result.error
+                        yield result
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def stream(self, path: str, **kwargs) -> Iterator[str]:
+        """Render the file little by little.
+        This is a generator version of :meth:`miko.manager.Manager.render`. (See :meth:`miko.template.Template.stream`)
+
+        Parameters
+        ----------
+        path : str
+            The path to the file.
+        **kwargs
+            The keyword arguments to pass to :meth:`miko.template.Template.stream`."""
+        return self.get_template(path).stream(**kwargs)
+
+    async def aiostream(self, path: str, **kwargs) -> AsyncIterator[str]:
+        """This is an asynchronous version of :meth:`miko.manager.Manager.stream`.
+
+        Parameters
+        ----------
+        path : str
+            The path to the file.
+        **kwargs
+            The keyword arguments to pass to :meth:`miko.template.Template.aiostream`."""
+        async for chunk in (await self.aio_get_template(path)).aiostream(**kwargs):
+            yield chunk
+
+    def preload(
+        self, root: str, pattern: str = "**/*.html",
+        signatures: Iterable[tuple[str, ...]] | None = None,
+        async_function: bool = False
+    ) -> PreloadReport:
+        """Read, parse and compile all the templates under the directory in advance.  
+        If you call this before your server forks workers, the compiled templates are shared by them and are never compiled while handling requests.
+
+        Parameters
+        ----------
+        root : str
+            The directory where the templates are.
+        pattern : str, default "**/*.html"
+            The glob pattern of the templates relative to ``root``.
+        signatures : Iterable[tuple[str, ...]], optional
+            The names of the values that will be passed to the templates.  
+            A function is prepared for each of them.  
+            If it is not passed, the names used in the blocks which are not builtins are used. (See :meth:`miko.template.Template.get_default_args`)
+        async_function : bool, default False
+            Whether to prepare the functions for :meth:`miko.template.Template.aiorender`.
+
+        Returns
+        -------
+        PreloadReport
+            The numbers of the compiled templates and the errors.  
+            Errors do not stop the preloading, so check them if you want to validate the templates.
+
+        Notes
+        -----
+        The paths of the templates are ``os.path.normpath(os.path.join(root, relative_path))``.  
+        Pass the same paths when rendering so that the caches are used."""
+        report, start = PreloadReport(), perf_counter()
+        signatures = None if signatures is None else list(signatures)
+        for name in sorted(glob(pattern, root_dir=root, recursive=True)):
+            path = os.path.normpath(os.path.join(root, name))
+            if not os.path.isfile(path):
+                continue
+            try:
+                template = self.get_template(path)
+                blocks = sum(segment.is_block for segment in template.segments)
+                for args in signatures or (template.get_default_args(),):
+                    if args is None:
+                        # 名前が動的に使われる場合は、何が渡されるかわからないのでコンパイルしない。
+                        continue
+                    template.prepare(args, async_function=async_function)
+                    report.functions += 1
+            except Exception as error:
+                report.errors[path] = error
+            else:
+                report.templates += 1
+                report.blocks += blocks
+        report.seconds = perf_counter() - start
+        return report
 
     async def aiorender(self, path: str, **kwargs) -> str:
         """This is an asynchronous version of version for :meth:`miko.manager.Manager.render`.
@@ -119,4 +604,15 @@ class Manager:
             The path to the file.
         **kwargs
             Keyword arguments to pass to :meth:`miko.template.Template.aiorender`"""
-        return await (await self.aio_get_template(path)).aiorender(**kwargs)
\ No newline at end of file
+        template = await self.aio_get_template(path)
+        if not self.memoize:
+            return await template.aiorender(**kwargs)
+        key = self._get_output_key(path, template, kwargs)
+        if key is None:
+            return await template.aiorender(**kwargs)
+        output = await self._aio_get_output(key)
+        if output is None:
+            with track_dependencies() as dependencies:
+                output = await template.aiorender(**kwargs)
+            self._store_output(key, output, dependencies)
+        return output
\ No newline at end of file
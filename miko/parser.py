@@ -2,10 +2,79 @@
 
 from __future__ import annotations
 
+from typing import NamedTuple
 from collections.abc import Iterator
 
 
-__all__ = ("extract_blocks",)
+__all__ = ("DELIMITER", "ESCAPED_DELIMITER", "Segment", "tokenize", "extract_blocks")
+
+
+DELIMITER = "^^"
+"The two caret signs that enclose a block."
+ESCAPED_DELIMITER = "\\^^"
+"Writing this puts two caret signs as they are without starting or ending a block."
+
+
+class Segment(NamedTuple):
+    "This represents a piece of a template, which is static text or the code of a block."
+
+    index: int # type: ignore[assignment]
+    "The number of how many blocks. Static text has the number of the block before it."
+    is_block: bool
+    "Whether it is a block."
+    text: str
+    "The body. The escaped delimiters are already replaced with two caret signs."
+    line: int
+    "The line number where the body starts. (1-based)"
+    column: int
+    "The column offset where the body starts. (0-based)"
+
+
+def tokenize(template: str) -> Iterator[Segment]:
+    """Split a template into static text and blocks.
+    It finds the delimiters using ``str.find``, so each part of the template is copied only once.
+
+    Parameters
+    ----------
+    template : str
+        Target text
+
+    Yields
+    ------
+    Segment
+        The segments in order. Static text and blocks alternate and it always starts and ends with static text unless a block is not closed.
+
+    Notes
+    -----
+    If you want to put two caret signs as they are, write ``\\^^``."""
+    index, is_block = 0, False
+    start = offset = search = 0
+    line, parts = 1, []
+    while True:
+        position = template.find(DELIMITER, search)
+        if position == -1:
+            break
+        if position and template[position - 1] == "\\":
+            # エスケープされている場合は`\`を取り除いてそのまま続ける。
+            parts.append(template[start:position - 1])
+            start, search = position, position + 2
+            continue
+        parts.append(template[start:position])
+        if is_block:
+            index += 1
+        yield Segment(
+            index, is_block, "".join(parts),
+            line, offset - (template.rfind("\n", 0, offset) + 1)
+        )
+        # 次の部分の開始位置を計算する。
+        line += template.count("\n", offset, position + 2)
+        start = search = offset = position + 2
+        parts, is_block = [], not is_block
+    parts.append(template[start:])
+    yield Segment(
+        index + is_block, is_block, "".join(parts),
+        line, offset - (template.rfind("\n", 0, offset) + 1)
+    )
 
 
 def extract_blocks(template: str) -> Iterator[tuple[int, bool, str]]:
@@ -19,24 +88,10 @@ def extract_blocks(template: str) -> Iterator[tuple[int, bool, str]]:
     Yields
     ------
     tuple[int, bool, str]
-        This is a tuple of an integer for how many blocks, a boolean for whether it is a block, and the body."""
-    now, may = "", False
-    block, index = False, 0
-    # ブロックを取得します。
-    for character in template:
-        # tempylateのブロックかどうかを調べる。
-        if character == "^":
-            if may:
-                # ブロック終了時にはそのブロックを追加する。
-                if block:
-                    index += 1
-                yield index, block, now[:-1]
-                now, block = "", not block
-                continue
-            else:
-                may = True
-        elif may:
-            may = False
-        # blockを書き込んでいく。
-        now += character
-    yield index, block, now
\ No newline at end of file
+        This is a tuple of an integer for how many blocks, a boolean for whether it is a block, and the body.
+
+    See Also
+    --------
+    tokenize : This also yields the positions of the segments."""
+    for segment in tokenize(template):
+        yield segment[:3]
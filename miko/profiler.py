@@ -0,0 +1,180 @@
+# miko - Profiler
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from threading import Lock
+
+if TYPE_CHECKING:
+    from .template import Template
+
+
+__all__ = ("Instrument", "ProfileEntry", "Profiler")
+
+
+class Instrument:
+    """This is the base class of the hooks called while rendering.
+    Pass an instance of its subclass to :class:`miko.template.Template` or :class:`miko.manager.Manager` with the ``instrument`` argument, and override the methods you need.
+
+    Notes
+    -----
+    If an instrument is set, :meth:`miko.template.Template.render` and :meth:`miko.template.Template.aiorender` call the blocks one by one to measure them, which is a little slower.
+    If it is not set, nothing is measured and there is no overhead.
+    :meth:`miko.template.Template.stream` and :meth:`miko.template.Template.aiostream` are not measured."""
+
+    def on_render(self, template: Template, seconds: float) -> None:
+        "This is called after a template is rendered."
+
+    def on_block(self, template: Template, index: int, seconds: float) -> None:
+        "This is called after a block is run. ``index`` is the number of the block in the template."
+
+    def on_compile(self, path: str, seconds: float) -> None:
+        "This is called after a template is compiled."
+
+    def on_cache_miss(self, path: str, kind: str) -> None:
+        """This is called when something is not found in a cache.
+        ``kind`` is ``"function"`` for the functions of :class:`miko.template.Template`, or ``"template"`` or ``"output"`` for the caches of :class:`miko.manager.Manager`."""
+
+
+@dataclass
+class ProfileEntry:
+    "The times measured by :class:`miko.profiler.Profiler`."
+
+    calls: int = 0
+    "The number of the calls."
+    total: float = 0.0
+    "The total time in seconds."
+    max: float = 0.0
+    "The longest time in seconds."
+
+    @property
+    def mean(self) -> float:
+        "The average time in seconds."
+        return self.total / self.calls if self.calls else 0.0
+
+    def add(self, seconds: float) -> None:
+        "Add the time of a call."
+        self.calls += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+class Profiler(Instrument):
+    """The instrument that measures the time of each block, rendering and compiling.
+
+    Parameters
+    ----------
+    slow_threshold : float | None, default None
+        If a block takes longer than this in seconds, ``on_slow`` is called.
+    on_slow : Callable[[Template, int, float], None] | None, default None
+        The function called with the template, the number of the block and the time when a slow block is found.
+        You can use it to log the slow blocks in production.
+
+    Attributes
+    ----------
+    slow_threshold : float | None
+    on_slow : Callable[[Template, int, float], None] | None
+    blocks : dict[tuple[str, int], ProfileEntry]
+        The times of the blocks by the path of the template and the number of the block.
+    renders : dict[str, ProfileEntry]
+        The times of the renderings by the path.
+    compiles : dict[str, ProfileEntry]
+        The times of the compilations by the path.
+    misses : dict[tuple[str, str], int]
+        The numbers of the cache misses by the path and the kind.
+
+    Examples
+    --------
+    .. code-block:: python
+
+        profiler = Profiler(0.1, lambda template, index, seconds: logger.warning(
+            "The block %s of %s took %.3fs.", index, template.path, seconds
+        ))
+        manager = Manager(instrument=profiler)
+        ...
+        print(profiler.report())"""
+
+    def __init__(
+        self, slow_threshold: float | None = None,
+        on_slow: Callable[[Template, int, float], None] | None = None
+    ):
+        self.slow_threshold, self.on_slow = slow_threshold, on_slow
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        "Discard all the measured times."
+        with self._lock:
+            self.blocks: dict[tuple[str, int], ProfileEntry] = {}
+            self.renders: dict[str, ProfileEntry] = {}
+            self.compiles: dict[str, ProfileEntry] = {}
+            self.misses: dict[tuple[str, str], int] = {}
+
+    def _add(self, entries, key, seconds):
+        with self._lock:
+            entry = entries.get(key)
+            if entry is None:
+                entry = entries[key] = ProfileEntry()
+            entry.add(seconds)
+
+    def on_render(self, template: Template, seconds: float) -> None:
+        self._add(self.renders, template.path, seconds)
+
+    def on_block(self, template: Template, index: int, seconds: float) -> None:
+        self._add(self.blocks, (template.path, index), seconds)
+        if self.slow_threshold is not None and self.on_slow is not None \
+                and seconds >= self.slow_threshold:
+            self.on_slow(template, index, seconds)
+
+    def on_compile(self, path: str, seconds: float) -> None:
+        self._add(self.compiles, path, seconds)
+
+    def on_cache_miss(self, path: str, kind: str) -> None:
+        with self._lock:
+            self.misses[(path, kind)] = self.misses.get((path, kind), 0) + 1
+
+    def get_rows(
+        self, sort: str = "total"
+    ) -> list[tuple[str, str, ProfileEntry]]:
+        """Get the measured times sorted in descending order.
+
+        Parameters
+        ----------
+        sort : str, default "total"
+            The name of the attribute of :class:`miko.profiler.ProfileEntry` to sort by, which is ``"calls"``, ``"total"``, ``"max"`` or ``"mean"``.
+
+        Returns
+        -------
+        list[tuple[str, str, ProfileEntry]]
+            Tuples of the path, what was measured (``"render"``, ``"compile"`` or ``"block N"``) and the times."""
+        with self._lock:
+            rows = [
+                *((path, f"block {index}", entry) for (path, index), entry in self.blocks.items()),
+                *((path, "render", entry) for path, entry in self.renders.items()),
+                *((path, "compile", entry) for path, entry in self.compiles.items())
+            ]
+        rows.sort(key=lambda row: getattr(row[2], sort), reverse=True)
+        return rows
+
+    def report(self, sort: str = "total", limit: int | None = 20) -> str:
+        """Make a table of the measured times. (See :meth:`miko.profiler.Profiler.get_rows`)
+
+        Parameters
+        ----------
+        sort : str, default "total"
+        limit : int | None, default 20
+            The maximum number of the rows. If it is ``None``, there is no limit."""
+        rows = self.get_rows(sort)[:limit]
+        return "\n".join((
+            "{:>8} {:>10} {:>10} {:>10}  {}".format("calls", "total", "mean", "max", "where"),
+            *(
+                "{:>8} {:>9.3f}s {:>9.3f}ms {:>9.3f}ms  {}:{}".format(
+                    entry.calls, entry.total, entry.mean * 1000,
+                    entry.max * 1000, path, what
+                ) for path, what, entry in rows
+            )
+        ))
@@ -3,19 +3,34 @@
 from __future__ import annotations
 
 from typing import TYPE_CHECKING, TypeAlias, Any
-from collections.abc import Callable, Coroutine
+from collections.abc import Callable, Coroutine, Iterable, Iterator, AsyncIterator
+from types import CodeType
 
 from importlib._bootstrap_external import _code_type
-from inspect import cleandoc
+from asyncio import Semaphore, ensure_future, gather
+from time import perf_counter
+from inspect import isawaitable
+import builtins as _python_builtins
 import ast
 
-from collections import defaultdict
+from marshal import dumps
 
-from .builtins import _builtins, include, aioinclude
-from .parser import extract_blocks
+from .builtins import _builtins, include, aioinclude, Markup, _escape_value
+from .utils import (
+    CacheStats, LRUCache, _iterate_chunks, _aiterate_chunks,
+    _is_binary, _join_buffer, _add_note
+)
+from .bytecode import BytecodeCache
+from .parser import Segment, tokenize
+from .compiler import (
+    RENDER_FUNCTION_NAME, CHUNKS_FUNCTION_NAME, ASYNC_CHUNKS_FUNCTION_NAME,
+    ESCAPE_FUNCTION_NAME, _BLOCK_FUNCTION_NAME,
+    parse_block, collect_names, collect_free_names, compile_template, _make_function
+)
 
 if TYPE_CHECKING:
     from .manager import Manager
+    from .profiler import Instrument
 
 
 __all__ = (
@@ -24,8 +39,7 @@ __all__ = (
 )
 TypeMikoFunction: TypeAlias = Callable[..., Coroutine[Any, Any, str | Any] | str | Any]
 "The type of a function that wraps the code of block."
-_BLOCK_FUNCTION_CODE = "<async>def __miko_function(<<args>>):..."
-# テンプレートにあったブロックを実行するための関数
+_MISSING = object()
 DEFAULT_BUILTINS = _builtins
 "Default builtins."
 DEFAULT_ADJUSTORS: list[Adjustor] = []
@@ -34,6 +48,20 @@ Adjustor: TypeAlias = Callable[["Template", dict], Any]
 "Type of adjustor."
 
 
+class _AdjustorContext(dict):
+    # アジャスターに渡す辞書。渡された値に無い名前は、ブロックから見える名前空間から読む。
+    namespace: dict[str, Any]
+
+    def __missing__(self, key):
+        return self.namespace[key]
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.namespace
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
 class Block:
     """This class represents a block.  
     When instantiated, it compiles the string of the passed block.
@@ -52,54 +80,143 @@ class Block:
         The number of how many blocks.  
         This is also just used to make it easier to find the error location when an error occurs in the code within a block.
     async_function : bool, default False
-        Whether or not to make the function of the block an asynchronous function."""
+        Whether or not to make the function of the block an asynchronous function.
+    line : int, default 1
+        The line number in the template where the string of the block starts.  
+        The line numbers in the traceback of an error in the block will point to the lines in the template.
+    column : int, default 0
+        The column offset in the template where the string of the block starts."""
 
     def __init__(
         self, text: str, args: tuple[str, ...], path: str = "", index: int = 0,
-        async_function: bool = False
+        async_function: bool = False, line: int = 1, column: int = 0
     ):
         self.text, self.path, self.index, self.args = text, path, index, args
+        self.line, self.column = line, column
 
         # ブロック内のコードを実行する関数を構成してバイトコンパイルする。
-        code = ast.parse(
-            _BLOCK_FUNCTION_CODE
-                .replace("<<args>>", ",".join(self.args), 1)
-                .replace("<async>", "async " if async_function else "", 1)
-        )
-        assert isinstance(code.body[-1], (ast.FunctionDef, ast.AsyncFunctionDef))
-        del code.body[-1].body[-1]
-        cleaned_block = cleandoc(self.text)
-        if isinstance((block_code := ast.parse(cleaned_block)).body[-1], ast.Expr):
-            # `%% user.name %%`のようにテンプレートに文字列を配置できるようにするためにもし最後に`return`がなければ配置する。
-            block_code.body.append(ast.Return(block_code.body.pop(-1).value)) # type: ignore
-        code.body[-1].body.extend(block_code.body)
+        name = _BLOCK_FUNCTION_NAME.format(self.index)
+        code = ast.Module(body=[_make_function(
+            name, self.args,
+            parse_block(self.text, line, column, self.path) or [ast.Pass()],
+            async_function
+        )], type_ignores=[])
         ast.fix_missing_locations(code)
-        code = compile(code, f"{self.index}th block of {self.path} template>", "exec")
+        code = compile(code, self.path or "unknown", "exec")
         assert isinstance(code, _code_type)
         # 関数を作る。
         namespace: dict[str, Any] = {}
         exec(code, namespace)
-        self.function: TypeMikoFunction = namespace["__miko_function"]
+        self.function: TypeMikoFunction = namespace[name]
 
     def __str__(self) -> str:
         return f"<Block text={self.text} args={self.args} path={self.path} function={self.function}>"
 
 
 class CacheManager:
-    """This is a cache management class that takes a block from a template string, compiles the code for that block, and caches it.
+    """This is a cache management class that takes a block from a template string, compiles the code for that block, and caches it.  
+    The caches are kept in one :class:`miko.utils.LRUCache`, so it is bounded and safe to use from multiple threads.
+
+    Parameters
+    ----------
+    max_entries : int | None, default 1024
+        The maximum number of the cached values. If it is ``None``, there is no limit.
+    max_bytes : int | None, default None
+        The approximate memory budget of the cached values in bytes. If it is ``None``, there is no limit.  
+        The size of a compiled template is estimated by the size of its marshalled code and the size of segments is estimated by the length of the template.
+    bytecode_cache : BytecodeCache | str | None, default None
+        The cache to store the compiled templates in files. If a string is passed, it is used as the directory of :class:`miko.bytecode.BytecodeCache`.  
+        If it is set, a new process loads the compiled templates from the files instead of parsing and compiling them.
 
     Attributes
     ----------
-    block_caches : DefaultDict[str, dict[tuple[str, ...], dict[int, Block]]]
-    filter_caches : dict[str, Callable]"""
+    entries : LRUCache[tuple, Any]
+        The cache. The keys are tuples starting with ``"block"``, ``"segments"``, ``"names"`` or ``"code"``.
+    stats : CacheStats
+        The counters of hits, misses, evictions and compiles.
+    bytecode_cache : BytecodeCache | None
 
-    block_caches: defaultdict[str, dict[tuple[str, ...], dict[int, Block]]] = \
-        defaultdict(lambda : defaultdict(dict))
-    "Dictionary where the cache is stored."
+    Notes
+    -----
+    The instance in :data:`miko.template.caches` is used by default.  
+    You can pass another instance to :class:`miko.template.Template` with the ``cache_manager`` argument.  
+    When it is pickled, such as for :meth:`miko.manager.Manager.render_parallel`, the cached values are not sent and an empty one with the same options is made."""
+
+    def __init__(
+        self, max_entries: int | None = 1024, max_bytes: int | None = None,
+        bytecode_cache: BytecodeCache | str | None = None
+    ):
+        self.entries: LRUCache[tuple, Any] = LRUCache(max_entries, max_bytes)
+        self.bytecode_cache = BytecodeCache(bytecode_cache) \
+            if isinstance(bytecode_cache, str) else bytecode_cache
+
+    def __reduce__(self):
+        # ロックを持っているので、同じ設定の空のキャッシュとして送る。
+        return self.__class__, (
+            self.entries.max_entries, self.entries.max_bytes, self.bytecode_cache
+        )
+
+    @property
+    def stats(self) -> CacheStats:
+        "The counters of hits, misses, evictions and compiles."
+        return self.entries.stats
+
+    def invalidate(self, path: str | None = None) -> int:
+        """Remove the compiled blocks and functions.
+
+        Parameters
+        ----------
+        path : str | None, default None
+            The path of the template. If it is ``None``, all caches are removed.
+
+        Returns
+        -------
+        int
+            How many values were removed."""
+        if path is None:
+            count = len(self.entries)
+            self.entries.clear()
+            return count
+        return self.entries.discard(
+            lambda key: key[0] in ("block", "code") and key[1] == path
+        )
+
+    def _get(self, key: tuple, text: str) -> Any:
+        # キャッシュを取得する。テンプレートが変更されている場合は、このキーの値だけが作り直されて上書きされる。
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != text:
+            return None
+        return entry[1]
+
+    def _set(self, key: tuple, text: str, value: Any, size: int) -> None:
+        self.entries.set(key, (text, value), size)
+
+    def _count_compile(self):
+        # 他の数と同じように、ロックの中で数える。
+        with self.entries.lock:
+            self.stats.compiles += 1
+
+    def _load_or_make(
+        self, key: tuple, text: str, make: Callable[[], Any],
+        expected: type | tuple[type, ...]
+    ) -> Any:
+        # ファイルのキャッシュがあればそれを使い、なければ作ってファイルに保存する。
+        if self.bytecode_cache is not None:
+            file_key = self.bytecode_cache.get_key(*key, text)
+            # `None`も保存できるように、値はタプルに入れて保存する。
+            value = self.bytecode_cache.load(file_key)
+            if isinstance(value, tuple) and len(value) == 1 \
+                    and isinstance(value[0], expected):
+                return value[0]
+        value = make()
+        self._count_compile()
+        if self.bytecode_cache is not None:
+            self.bytecode_cache.dump(file_key, (value,))
+        return value
 
     def get_block(
         self, path: str, args: tuple[str, ...], index: int, text: str,
-        async_function: bool = False
+        async_function: bool = False, line: int = 1, column: int = 0
     ) -> Block:
         """Turn the string in the passed block into a block object.  
         It also creates a cache and returns the cache the next time the same string is passed.
@@ -121,20 +238,107 @@ class CacheManager:
         text : str
             The string of the block.
         async_function : bool, default False
-            Whether or not to make the function of the block an asynchronous function."""
-        block, update = self.block_caches[path][args].get(index), False
+            Whether or not to make the function of the block an asynchronous function.
+        line : int, default 1
+            The line number in the template where the string of the block starts.
+        column : int, default 0
+            The column offset in the template where the string of the block starts."""
+        key = ("block", path, args, index, async_function)
+        block = self._get(key, text)
         if block is None:
-            update = True
-        elif block.text != text:
-            # もしブロック内のコードが変更されている場合はそのブロックがあるキャッシュを全て削除する。
-            del self.block_caches[path]
-            update = True
-        if update:
-            self.block_caches[path][args][index] = block = Block(
-                text, args, path, index,async_function
-            )
-        assert block is not None
+            block = Block(text, args, path, index, async_function, line, column)
+            self._count_compile()
+            self._set(key, text, block, len(text))
         return block
+
+    def get_segments(self, text: str) -> tuple[Segment, ...]:
+        """Parse the template string into segments and cache it.
+        The cache is associated with the content of the template string, so the parsing is done only once for each version of the template.
+
+        Parameters
+        ----------
+        text : str
+            The template string.
+
+        Returns
+        -------
+        tuple[Segment, ...]
+            The segments yielded by :func:`miko.parser.tokenize`."""
+        key = ("segments", text)
+        segments = self.entries.get(key)
+        if segments is None:
+            segments = tuple(tokenize(text))
+            self.entries.set(key, segments, len(text))
+        return segments
+
+    def get_names(self, text: str, path: str = "unknown") -> frozenset[str] | None:
+        """Collect the names used in the blocks of the template string and cache it.
+
+        Parameters
+        ----------
+        text : str
+            The template string.
+        path : str, default "unknown"
+            The path of the file for that template string. This is used for syntax errors.
+
+        Returns
+        -------
+        frozenset[str] | None
+            The value returned by :func:`miko.compiler.collect_names`."""
+        key = ("names", text)
+        # `None`も値として保存されるので、無いことは`_MISSING`で判断する。
+        names = self.entries.get(key, _MISSING)
+        if names is not _MISSING:
+            return names
+        names = self._load_or_make(
+            ("names",), text,
+            lambda : collect_names(self.get_segments(text), path),
+            (frozenset, type(None))
+        )
+        self.entries.set(key, names, 0 if names is None else len(names))
+        return names
+
+    def get_code(
+        self, path: str, args: tuple[str, ...], text: str,
+        async_function: bool = False, stream: bool = False, split: bool = False,
+        minify: bool = False, autoescape: bool = False
+    ) -> CodeType:
+        """Compile the whole template string into one code object and cache it.
+        When the code is executed, it defines a function that returns the rendered text of the whole template.  
+        (See :func:`miko.compiler.compile_template`)
+
+        Parameters
+        ----------
+        path : str
+            The path of the file for that template string.
+            It is used for the cache in the same way as :meth:`miko.template.CacheManager.get_block`.
+        args : tuple[str, ...]
+            A tuple of the names of the values that would be passed to the template.  
+            This should be normalized by :meth:`miko.template.CacheManager.get_names` such as :meth:`miko.template.Template.get_args` does, so that the cache is not created for every order of names or for every name that is not used.
+        text : str
+            The template string.
+        async_function : bool, default False
+            Whether or not to make the function an asynchronous function.
+        stream : bool, default False
+            Whether to make the function a generator which yields the rendered text in chunks.
+        split : bool, default False
+            Whether to make the function return the parts of the template without calling the blocks. (See :func:`miko.compiler.compile_template`)
+        minify : bool, default False
+            Whether to collapse whitespace in the static text. (See :func:`miko.compiler.minify_whitespace`)
+        autoescape : bool, default False
+            Whether to escape the values of the blocks. (See :func:`miko.compiler.compile_template`)"""
+        key = ("code", path, args, async_function, stream, split, minify, autoescape)
+        code = self._get(key, text)
+        if code is None:
+            # コンパイルはロックの外で行う。同時に同じものがコンパイルされても、後のもので上書きされるだけ。
+            code = self._load_or_make(
+                key, text, lambda : compile_template(
+                    self.get_segments(text), args, path, async_function,
+                    stream, split, minify, autoescape
+                ), CodeType
+            )
+            self._set(key, text, code, len(dumps(code)))
+        return code
 caches = CacheManager()
 
 
@@ -149,18 +353,44 @@ class Template:
         The path to the file of template text.  
         This should be unique for each template string, because it is used as the name in association with the post-compile function cache for the blocks in the template.
     builtins : dict[str, Any], default DEFAULT_BUILTINS.copy()
-        A dictionary of names and values of variables to be passed by default when executing blocks in the template.
+        A dictionary of names and values of variables to be passed by default when executing blocks in the template.  
+        They are put in the globals of the compiled functions once. (See :meth:`miko.template.Template.get_namespace`)
     adjustors : list[Adjustor], default DEFAULT_ADJUSTORS.copy()
         The functions in this list are called when the template is rendered.  
         When the function is called, it is passed an instance of this class (``self``) and a dictionary containing the values passed to the template.  
-        This allows you to extend the value passed in.
+        This allows you to extend the value passed in.  
+        The names which are not passed, such as ``manager`` and the builtins, can also be read from the dictionary, and only the values set to it are passed to the template.
+    cache_manager : CacheManager | None, default None
+        The cache manager used to cache the parsed segments and the compiled functions.  
+        If it is ``None``, :data:`miko.template.caches` is used.
+    concurrency : int | None, default None
+        If it is not ``None``, the blocks are run concurrently by :meth:`miko.template.Template.aiorender`.  
+        A positive number limits how many blocks run at the same time, and ``0`` means no limit.  
+        Only use this if the blocks do not depend on each other, such as values set to ``self`` in another block.  
+        If a block raises an error, the number of the block and the path are added to the notes of the error. On Python 3.10, they are only in ``__notes__`` and not shown in the traceback.
+    instrument : Instrument | None, default None
+        The hooks called when the template is rendered or compiled, such as :class:`miko.profiler.Profiler`.  
+        If it is ``None``, nothing is measured.
+    minify : bool, default False
+        Whether to collapse whitespace in the static text when compiling the template. (See :func:`miko.compiler.minify_whitespace`)  
+        If you change it after rendering, call :meth:`miko.template.Template.reset`.
+    autoescape : bool, default False
+        Whether to escape the values of the blocks for HTML.  
+        A value which is :class:`miko.builtins.Markup` or has ``__html__`` is not escaped, such as the outputs of ``self.extends``, ``include`` and ``escape``.  
+        If you change it after rendering, call :meth:`miko.template.Template.reset`.
 
     Attributes
     ----------
     template : str
     path : str
     builtins : dict[str, Any]
-    adjustors : list[Adjustor]"""
+    adjustors : list[Adjustor]
+    cache_manager : CacheManager | None
+    concurrency : int | None
+    instrument : Instrument | None
+    minify : bool
+    autoescape : bool
+    segments : tuple[Segment, ...]"""
 
     __original_kwargs__: dict
     __option_kwargs__: dict
@@ -169,10 +399,20 @@ class Template:
     def __init__(
         self, template: str, *, path: str = "unknown",
         builtins: dict[str, Any] = DEFAULT_BUILTINS.copy(),
-        adjustors: list[Adjustor] = DEFAULT_ADJUSTORS.copy()
+        adjustors: list[Adjustor] = DEFAULT_ADJUSTORS.copy(),
+        cache_manager: CacheManager | None = None,
+        concurrency: int | None = None, instrument: Instrument | None = None,
+        minify: bool = False, autoescape: bool = False
     ):
         self.template, self.path = template, path
         self.builtins, self.adjustors = builtins, adjustors
+        self.cache_manager, self.concurrency = cache_manager, concurrency
+        self.instrument, self.minify = instrument, minify
+        self.autoescape = autoescape
+        self._namespaces: dict[bool, dict[str, Any]] = {}
+        self._functions: dict[tuple[tuple[str, ...], bool, bool, bool, bool], TypeMikoFunction] = {}
+        self._source: str | None = None
+        self._names: frozenset[str] | None = None
 
     def __new__(cls, *_, **kwargs):
         # キーワード引数を取るだけ。
@@ -183,6 +423,15 @@ class Template:
             del self.__option_kwargs__["path"]
         return self
 
+    @property
+    def _caches(self) -> CacheManager:
+        return caches if self.cache_manager is None else self.cache_manager
+
+    @property
+    def segments(self) -> tuple[Segment, ...]:
+        "The segments of the template parsed by :func:`miko.parser.tokenize`. The parsing is done only once for each version of the template."
+        return self._caches.get_segments(self.template)
+
     @classmethod
     def from_file(cls, path: str, **kwargs) -> Template:
         """Prepare template from file easily.
@@ -201,18 +450,163 @@ class Template:
         Parameters is same as :meth:`miko.template.Template.from_file`."""
         return cls(await aioinclude(path), path=path, **kwargs)
 
-    def _prepare_render(self, kwargs, include_globals):
-        # グローバルなものを混ぜる。
-        if include_globals:
-            kwargs.update(globals())
-        kwargs["self"] = self
-        if hasattr(self, "manager"):
-            kwargs["manager"] = self.manager
-        # ビルトインを混ぜる。
-        kwargs.update(self.builtins)
+    def get_namespace(self, include_globals: bool = True) -> dict[str, Any]:
+        """Get the namespace used as the globals of the compiled functions of the template.  
+        It contains the data in ``globals()`` (if ``include_globals`` is ``True``), ``manager`` and the builtins, and is made only once.  
+        So only the values passed to the template and ``self`` are handled for each rendering.
+
+        Parameters
+        ----------
+        include_globals : bool, default True
+            Whether to include the data in the dictionary that can be retrieved by ``globals()``.
+
+        Notes
+        -----
+        The namespace is made at the first rendering.  
+        If you change ``builtins`` or ``manager`` after that, call :meth:`miko.template.Template.reset`."""
+        namespace = self._namespaces.get(include_globals)
+        if namespace is None:
+            # グローバルなものとビルトインを混ぜる。
+            # モジュールの`__name__`や`__loader__`などを入れると、トレースバックにこのファイルの行が表示されてしまうので除く。
+            namespace = {
+                key: value for key, value in globals().items()
+                if not (key.startswith("__") and key.endswith("__"))
+            } if include_globals else {}
+            namespace["manager"] = self.manager
+            namespace[CHUNKS_FUNCTION_NAME] = _iterate_chunks
+            namespace[ASYNC_CHUNKS_FUNCTION_NAME] = _aiterate_chunks
+            namespace[ESCAPE_FUNCTION_NAME] = _escape_value
+            namespace.update(self.builtins)
+            self._namespaces[include_globals] = namespace
+        return namespace
+
+    def reset(self) -> None:
+        "Discard the namespace and the functions prepared for rendering. They will be prepared again at the next rendering."
+        self._namespaces, self._functions, self._source = {}, {}, None
+
+    def copy(self) -> Template:
+        """Make a copy of the template which shares the namespace and the functions prepared for rendering.  
+        Because attributes set to ``self`` in a block are not shared with the copy, it is used to render a cached template.
+
+        Returns
+        -------
+        Template
+            The copy."""
+        template = object.__new__(self.__class__)
+        template.__dict__.update(self.__dict__)
+        return template
+
+    def _check_source(self):
+        if self._source is not self.template:
+            # テンプレートが変更された場合は作った関数を全て捨てる。コピーと共有しているかもしれないので新しい辞書にする。
+            self._functions = {}
+            self._names = self._caches.get_names(self.template, self.path)
+            self._source = self.template
+
+    def prepare(
+        self, args: tuple[str, ...], include_globals: bool = True,
+        async_function: bool = False, stream: bool = False, split: bool = False
+    ) -> TypeMikoFunction:
+        """Prepare the function that renders the template.
+        This is done automatically when rendering, but you can use this to compile the template in advance.
+
+        Parameters
+        ----------
+        args : tuple[str, ...]
+            The names of the values that would be passed to the template.  
+            They are normalized in the same way as :meth:`miko.template.Template.get_args`.
+        include_globals : bool, default True
+            Whether to include the data in the dictionary that can be retrieved by ``globals()``.
+        async_function : bool, default False
+            Whether or not to make the function an asynchronous function.
+        stream : bool, default False
+            Whether to make the function a generator used by :meth:`miko.template.Template.stream` or :meth:`miko.template.Template.aiostream`.
+        split : bool, default False
+            Whether to make the function return the parts of the template without calling the blocks. (See :func:`miko.compiler.compile_template`)
+
+        Returns
+        -------
+        TypeMikoFunction
+            The function. It takes the values passed to the template as keyword arguments."""
+        self._check_source()
+        args = tuple(sorted(
+            args if self._names is None else self._names.intersection(args)
+        ))
+        key = (args, include_globals, async_function, stream, split)
+        function = self._functions.get(key)
+        if function is None:
+            if self.instrument is not None:
+                self.instrument.on_cache_miss(self.path, "function")
+                start, compiles = perf_counter(), self._caches.stats.compiles
+            namespace = self.get_namespace(include_globals).copy()
+            exec(self._caches.get_code(
+                self.path, args, self.template, async_function, stream, split,
+                self.minify, self.autoescape
+            ), namespace)
+            self._functions[key] = function = namespace[RENDER_FUNCTION_NAME]
+            if self.instrument is not None and compiles != self._caches.stats.compiles:
+                self.instrument.on_compile(self.path, perf_counter() - start)
+        return function
+
+    def get_default_args(self, include_globals: bool = True) -> tuple[str, ...] | None:
+        """Guess the names of the values that would be passed to the template.
+        They are the names read in the blocks which are not bound in the blocks and are neither in :meth:`miko.template.Template.get_namespace` nor Python builtins.  
+        If a block looks up names dynamically, ``None`` is returned.
+
+        Parameters
+        ----------
+        include_globals : bool, default True
+            Whether to include the data in the dictionary that can be retrieved by ``globals()``."""
+        self._check_source()
+        if self._names is None:
+            return None
+        names = collect_free_names(self.segments, self.path)
+        if names is None:
+            return None
+        return tuple(sorted(
+            names - self.get_namespace(include_globals).keys()
+            - _python_builtins.__dict__.keys()
+        ))
+
+    def _adjust(self, template, kwargs, include_globals):
+        # 以前のようにビルトインなども読めるように、無い名前は名前空間から読む辞書を渡す。書き込んだものだけを渡す値にする。
+        context = _AdjustorContext(kwargs)
+        context.namespace = self.get_namespace(include_globals)
         for decorator in self.adjustors:
-            decorator(self, kwargs)
-        return tuple(kwargs.keys())
+            decorator(template, context)
+        kwargs.clear()
+        kwargs.update(context)
+
+    def _prepare_render(
+        self, kwargs, include_globals, async_function, stream=False, split=False
+    ):
+        kwargs["self"] = self
+        if self.adjustors:
+            self._adjust(self, kwargs, include_globals)
+        if self._source is not self.template:
+            self._check_source()
+        args = tuple(sorted(
+            kwargs if self._names is None else self._names.intersection(kwargs)
+        ))
+        function = self._functions.get(
+            (args, include_globals, async_function, stream, split)
+        )
+        if function is None:
+            function = self.prepare(
+                args, include_globals, async_function, stream, split
+            )
+        return function
+
+    def get_args(self, kwargs: dict[str, Any]) -> tuple[str, ...]:
+        """Get the names of the values that are passed to the compiled function of the template.
+        It is the sorted names in ``kwargs`` which are used in the blocks, so it does not depend on the order of ``kwargs`` or the names that are not used.
+
+        Parameters
+        ----------
+        kwargs : dict[str, Any]
+            The values that would be passed to the template."""
+        names = self._caches.get_names(self.template, self.path)
+        return tuple(sorted(kwargs if names is None else names.intersection(kwargs)))
 
     def render(self, include_globals: bool = True, **kwargs) -> str:
         """Render the template.
@@ -227,7 +621,9 @@ class Template:
 
         Notes
         -----
-        Each time the key of ``kwargs`` changes, the code in the block is compiled.  
+        Each time the names in ``kwargs`` that are used in the template change, the whole template is compiled into one function.  
+        The order of ``kwargs`` and the names which are not used in the template do not matter.  
+        If a name in ``kwargs`` is the same as the name of a builtin, the value in ``kwargs`` is used.  
         Functions created by compiling are cached.  
         Also, if you ``import`` a large library in a block, the first rendering will be slower, but after that it won't be as bad due to Python's cache.
 
@@ -237,12 +633,75 @@ class Template:
         (I don't think anyone would do that.)  
         So you should keep the value name constant.  
         Also, if the code in the block is made to be time-consuming, rendering will take time."""
-        args = self._prepare_render(kwargs, include_globals)
-        return "".join(
-            str(caches.get_block(self.path, args, index, text).function(**kwargs))
-            if is_block else text
-            for index, is_block, text in extract_blocks(self.template)
-        )
+        if self.instrument is None:
+            return self._prepare_render(kwargs, include_globals, False)(**kwargs)
+        return self._render_instrumented(kwargs, include_globals)
+
+    def _render_instrumented(self, kwargs, include_globals):
+        # ブロックを一つずつ呼び出して時間を計る。
+        instrument, start = self.instrument, perf_counter()
+        convert, chunks = _escape_value if self.autoescape else str, []
+        for part in self._prepare_render(
+            kwargs, include_globals, False, split=True
+        )(**kwargs):
+            if part.__class__ is str:
+                chunks.append(part)
+                continue
+            block_start = perf_counter()
+            value = part[1](*part[2])
+            instrument.on_block(self, part[0], perf_counter() - block_start)
+            chunks.append(convert(value))
+        instrument.on_render(self, perf_counter() - start)
+        return "".join(chunks)
+
+    def render_many(
+        self, contexts: Iterable[dict[str, Any]], include_globals: bool = True,
+        **kwargs
+    ) -> Iterator[str]:
+        """Render the template for each of the contexts.  
+        This is a generator, so the contexts are rendered one by one and the outputs are not kept.
+        The function is looked up only once for each set of names, so it is faster than calling :meth:`miko.template.Template.render` in a loop.
+
+        Parameters
+        ----------
+        contexts : Iterable[dict[str, Any]]
+            The values to pass to the template for each rendering. The dictionaries are not changed.
+        include_globals : bool, default True
+            Whether to include the data in the dictionary that can be retrieved by ``globals()``.
+        **kwargs
+            The values passed to all the renderings. A context overrides them.
+
+        Yields
+        ------
+        str
+            The outputs in the order of the contexts.
+
+        Examples
+        --------
+        .. code-block:: python
+
+            for user, text in zip(users, template.render_many(
+                ({"user": user} for user in users), site=site
+            )):
+                send_mail(user.address, text)"""
+        return self._render_many(contexts, include_globals, kwargs, False)
+
+    def _render_many(self, contexts, include_globals, kwargs, copy):
+        # 同じ名前の組み合わせが続くことが多いので、名前の並びごとに関数を覚えておく。
+        functions: dict[tuple[str, ...], TypeMikoFunction] = {}
+        template = self
+        for context in contexts:
+            if copy:
+                template = self.copy()
+            values = {**kwargs, **context}
+            values["self"] = template
+            if self.adjustors:
+                self._adjust(template, values, include_globals)
+            names = tuple(values)
+            function = functions.get(names)
+            if function is None:
+                function = functions[names] = self.prepare(names, include_globals)
+            yield function(**values)
 
     async def aiorender(self, include_globals: bool = True, **kwargs) -> str:
         """This is an asynchronous version of :meth:`miko.template.Template.render`.
@@ -257,14 +716,222 @@ class Template:
 
         Notes
         -----
-        You can use ``await`` and call asynchronous functions in the template rendered by this method."""
-        args = self._prepare_render(kwargs, include_globals)
-        return "".join([
-            str(await caches.get_block(self.path, args, index, text, True)
-                    .function(**kwargs)) # type: ignore
-            if is_block else text
-            for index, is_block, text in extract_blocks(self.template)
-        ])
+        You can use ``await`` and call asynchronous functions in the template rendered by this method.  
+        If ``concurrency`` of this class is set, the blocks are run concurrently and the results are joined in order."""
+        if self.concurrency is None and self.instrument is None:
+            return await self._prepare_render(
+                kwargs, include_globals, True
+            )(**kwargs) # type: ignore
+        start = perf_counter()
+        parts = self._prepare_render(kwargs, include_globals, True, split=True)(**kwargs)
+        if self.concurrency is None:
+            text = await self._aiorender_instrumented(parts)
+        else:
+            text = await self._render_concurrently(parts)
+        if self.instrument is not None:
+            self.instrument.on_render(self, perf_counter() - start)
+        return text
+
+    async def _aiorender_instrumented(self, parts):
+        instrument, chunks = self.instrument, []
+        convert = _escape_value if self.autoescape else str
+        for part in parts:
+            if part.__class__ is str:
+                chunks.append(part)
+                continue
+            block_start = perf_counter()
+            value = await part[1](*part[2])
+            instrument.on_block(self, part[0], perf_counter() - block_start)
+            chunks.append(convert(value))
+        return "".join(chunks)
+
+    async def _render_concurrently(self, parts):
+        semaphore = Semaphore(self.concurrency) if self.concurrency else None
+
+        instrument = self.instrument
+
+        async def run(index, function, args):
+            try:
+                if semaphore is None:
+                    start = perf_counter()
+                    value = await function(*args)
+                else:
+                    async with semaphore:
+                        start = perf_counter()
+                        value = await function(*args)
+                if instrument is not None:
+                    instrument.on_block(self, index, perf_counter() - start)
+                return value
+            except Exception as error:
+                # どのブロックでエラーが発生したかわかるようにする。
+                _add_note(error, f"This error occurred in block {index} of {self.path}.")
+                raise
+
+        tasks = [ensure_future(run(*part)) for part in parts if part.__class__ is not str]
+        try:
+            results = iter(await gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        convert = _escape_value if self.autoescape else str
+        return "".join(
+            part if part.__class__ is str else convert(next(results))
+            for part in parts
+        )
+
+    def stream(self, include_globals: bool = True, **kwargs) -> Iterator[str]:
+        """Render the template little by little.
+        This is a generator which yields the static text and the values of the blocks as soon as they are made, so the whole text is not built in memory.  
+        It is useful for sending a large page with a web framework which supports streaming responses.
+
+        Parameters
+        ----------
+        include_globals : bool, default True
+            Whether to include the data in the dictionary that can be retrieved by ``globals()`` in the variables passed to the code in the block.
+        **kwargs
+            The name and value dictionary of the value to pass to the template.
+
+        Yields
+        ------
+        str
+            The chunks of the rendered text.
+
+        Notes
+        -----
+        If the value of a block is an iterator such as a generator, a list or a tuple, its items are yielded one by one instead of converting the value to a string.  
+        So you can make a block which returns a generator to stream a large table.
+
+        Examples
+        --------
+        .. code-block:: python
+
+            @app.get("/export")
+            def export():
+                return Response(manager.stream("export.csv", rows=fetch_rows()))"""
+        return self._prepare_render(kwargs, include_globals, False, True)(**kwargs)
+
+    def aiostream(self, include_globals: bool = True, **kwargs) -> AsyncIterator[str]:
+        """This is an asynchronous version of :meth:`miko.template.Template.stream`.  
+        The chunks are yielded as soon as each block is done, so an ASGI application can send the page before the slowest block finishes.
+
+        Parameters
+        ----------
+        include_globals : bool, default True
+            Whether to include the data in the dictionary that can be retrieved by ``globals()`` in the variables passed to the code in the block.
+        **kwargs
+            The name and value dictionary of the value to pass to the template.
+
+        Yields
+        ------
+        str
+            The chunks of the rendered text.
+
+        Notes
+        -----
+        In addition to the ones of :meth:`miko.template.Template.stream`, the items of an asynchronous iterator returned by a block are also yielded one by one."""
+        return self._prepare_render(kwargs, include_globals, True, True)(**kwargs)
+
+    def render_to(
+        self, fp: Any, include_globals: bool = True, encoding: str = "utf-8",
+        buffer_size: int = 8192, binary: bool | None = None, **kwargs
+    ) -> int:
+        """Render the template and write it to a file-like object.
+        The static text and the value of each block are written little by little, so the whole text is not built in memory.  
+        The written text is the same as the one returned by :meth:`miko.template.Template.render`.  
+        Unlike :meth:`miko.template.Template.stream`, a block which returns an iterator such as a list or a generator is converted by ``str`` and not written item by item.
+
+        Parameters
+        ----------
+        fp : Any
+            The file-like object which has ``write``. It can be opened in text mode or binary mode.
+        include_globals : bool, default True
+            Whether to include the data in the dictionary that can be retrieved by ``globals()`` in the variables passed to the code in the block.
+        encoding : str, default "utf-8"
+            The encoding used if ``fp`` is opened in binary mode.
+        buffer_size : int, default 8192
+            The number of characters collected before writing them. If it is ``0``, each chunk is written at once.
+        binary : bool | None, default None
+            Whether to write bytes encoded by ``encoding``.  
+            If it is ``None``, it is guessed from ``fp``: files opened in binary mode and ``asyncio.StreamWriter`` are regarded as binary, and the others are regarded as binary if their ``mode`` has ``b``.
+        **kwargs
+            The name and value dictionary of the value to pass to the template.
+
+        Returns
+        -------
+        int
+            The number of the characters or bytes written.
+
+        Examples
+        --------
+        .. code-block:: python
+
+            with open("report.html", "wb") as f:
+                template.render_to(f, rows=fetch_rows())"""
+        binary, written = _is_binary(fp) if binary is None else binary, 0
+        convert = _escape_value if self.autoescape else str
+        buffer: list[str] = []
+        size = 0
+        # `stream`はブロックの値を展開してしまうので、`render`と同じ結果になるように分割した関数を使う。
+        for part in self._prepare_render(kwargs, include_globals, False, split=True)(**kwargs):
+            chunk = part if part.__class__ is str else convert(part[1](*part[2]))
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= buffer_size:
+                data = _join_buffer(buffer, binary, encoding)
+                fp.write(data)
+                written += len(data)
+                size = 0
+        if buffer:
+            data = _join_buffer(buffer, binary, encoding)
+            fp.write(data)
+            written += len(data)
+        return written
+
+    async def aiorender_to(
+        self, fp: Any, include_globals: bool = True, encoding: str = "utf-8",
+        buffer_size: int = 8192, binary: bool | None = None, **kwargs
+    ) -> int:
+        """This is an asynchronous version of :meth:`miko.template.Template.render_to`.  
+        If ``write`` of ``fp`` returns an awaitable object, it is awaited, and if ``fp`` has ``drain`` like ``asyncio.StreamWriter``, it is awaited after each writing.
+
+        Parameters
+        ----------
+        fp : Any
+        include_globals : bool, default True
+        encoding : str, default "utf-8"
+        buffer_size : int, default 8192
+        binary : bool | None, default None
+        **kwargs
+
+        Returns
+        -------
+        int"""
+        binary, written = _is_binary(fp) if binary is None else binary, 0
+        convert = _escape_value if self.autoescape else str
+        drain = getattr(fp, "drain", None)
+        buffer: list[str] = []
+        size = 0
+
+        async def write():
+            data = _join_buffer(buffer, binary, encoding)
+            result = fp.write(data)
+            if isawaitable(result):
+                await result
+            if drain is not None:
+                await drain()
+            return len(data)
+
+        for part in self._prepare_render(kwargs, include_globals, True, split=True)(**kwargs):
+            chunk = part if part.__class__ is str else convert(await part[1](*part[2]))
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= buffer_size:
+                written += await write()
+                size = 0
+        if buffer:
+            written += await write()
+        return written
 
     def extends(self, path: str, **kwargs) -> str:
         """Renders the file in the passed path with this class instanced by the options passed when instantiating this class.  
@@ -311,6 +978,8 @@ class Template:
 
         Notes
         -----
+        If the template is made by :class:`miko.manager.Manager`, the template of ``path`` is got from the cache of the manager.
+
         Maybe the arguments of ``extends`` become too long and troublesome when you extend the web page.
         In such a case, you can create a function that calls this function internally and put it in the argument ``extends`` of the :class:`miko.manager.Manager`.
         This way it will be like an alias and more efficient.
@@ -336,7 +1005,13 @@ class Template:
                     Today I had my birthday.
                 \"\"\"
             ) ^^"""
-        return self.__class__.from_file(path, **self.__option_kwargs__).render(**kwargs)
+        if self.manager is not None:
+            self.manager.dependencies.add(self.path, path)
+            text = self.manager.get_template(path).render(**kwargs)
+        else:
+            text = self.__class__.from_file(path, **self.__option_kwargs__).render(**kwargs)
+        # 描画されたものは既にエスケープされているので、もう一度エスケープされないようにする。
+        return Markup(text) if self.autoescape else text
 
     async def aioextends(self, path: str, **kwargs) -> str:
         """This is an asynchronous version of :meth:`miko.template.Template.extends`.
@@ -347,6 +1022,11 @@ class Template:
             The path to a template.
         **kwargs
             Keyword arguments to pass to :meth:`miko.template.Template.aiorender`."""
-        return await (
-            await self.__class__.aio_from_file(path, **self.__option_kwargs__)
-        ).aiorender(**kwargs)
\ No newline at end of file
+        if self.manager is not None:
+            self.manager.dependencies.add(self.path, path)
+            text = await (await self.manager.aio_get_template(path)).aiorender(**kwargs)
+        else:
+            text = await (
+                await self.__class__.aio_from_file(path, **self.__option_kwargs__)
+            ).aiorender(**kwargs)
+        return Markup(text) if self.autoescape else text
\ No newline at end of file
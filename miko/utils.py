@@ -1,6 +1,22 @@
 # miko - Utils
 
-from asyncio import get_running_loop, new_event_loop
+from __future__ import annotations
+
+from typing import TypeVar, Generic, Any
+from collections.abc import Callable, Iterator, AsyncIterator
+
+from collections import OrderedDict
+from io import TextIOBase, RawIOBase, BufferedIOBase
+from asyncio import StreamWriter
+from dataclasses import dataclass
+from threading import RLock
+
+
+__all__ = ("CacheStats", "LRUCache", "DependencyGraph")
+
+
+KeyT = TypeVar("KeyT")
+ValueT = TypeVar("ValueT")
 
 
 def _get_all(globals_, all_, mode="dict"):
@@ -14,18 +30,221 @@ def _get_all(globals_, all_, mode="dict"):
         ]
 
 
-async def _executor_function(function, loop, *args, **kwargs):
-    # 渡された関数を非同期に実行します。
-    close = False
-    if loop is None:
-        try:
-            loop = get_running_loop()
-        except RuntimeError:
-            loop = new_event_loop()
-            close = True
-    result = await loop.run_in_executor(
-        None, lambda : function(*args, **kwargs)
-    )
-    if close:
-        loop.close()
-    return result
\ No newline at end of file
+@dataclass
+class CacheStats:
+    "The counters of a cache."
+
+    hits: int = 0
+    "The number of times a value was found in the cache."
+    misses: int = 0
+    "The number of times a value was not found in the cache."
+    evictions: int = 0
+    "The number of values removed to keep the limits of the cache."
+    compiles: int = 0
+    "The number of times something was compiled because of a miss."
+
+    def reset(self) -> None:
+        "Set all the counters to zero."
+        self.hits = self.misses = self.evictions = self.compiles = 0
+
+
+class LRUCache(Generic[KeyT, ValueT]):
+    """Thread-safe cache that removes the least recently used values when it exceeds its limits.
+
+    Parameters
+    ----------
+    max_entries : int | None, default None
+        The maximum number of values. If it is ``None``, there is no limit.
+    max_bytes : int | None, default None
+        The maximum total size of values. If it is ``None``, there is no limit.  
+        The size of each value is the one passed to :meth:`miko.utils.LRUCache.set`.
+
+    Attributes
+    ----------
+    max_entries : int | None
+    max_bytes : int | None
+    stats : CacheStats
+    size : int
+        The total size of the values in the cache.
+    lock : threading.RLock"""
+
+    def __init__(
+        self, max_entries: int | None = None, max_bytes: int | None = None
+    ):
+        self.max_entries, self.max_bytes = max_entries, max_bytes
+        self.stats, self.size, self.lock = CacheStats(), 0, RLock()
+        self._entries: OrderedDict[KeyT, tuple[ValueT, int]] = OrderedDict()
+
+    def get(self, key: KeyT, default: Any = None) -> ValueT | Any:
+        "Get the value and mark it as recently used. If there is no value, ``default`` is returned."
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry[0]
+
+    def peek(self, key: KeyT, default: Any = None) -> ValueT | Any:
+        "Get the value without marking it as recently used or counting it in the stats."
+        entry = self._entries.get(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key: KeyT, value: ValueT, size: int = 0) -> None:
+        "Put the value and remove the least recently used values if the limits are exceeded."
+        with self.lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            # 制限を超えている間は古いものから消していく。
+            while len(self._entries) > 1 and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None and self.size > self.max_bytes)
+            ):
+                self.size -= self._entries.popitem(last=False)[1][1]
+                self.stats.evictions += 1
+
+    def pop(self, key: KeyT, default: Any = None) -> ValueT | Any:
+        "Remove the value and return it. If there is no value, ``default`` is returned."
+        with self.lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self.size -= entry[1]
+            return entry[0]
+
+    def discard(self, predicate: Callable[[KeyT], bool]) -> int:
+        "Remove all the values whose key satisfies ``predicate`` and return how many values were removed."
+        with self.lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self.size -= self._entries.pop(key)[1]
+            return len(keys)
+
+    def clear(self) -> None:
+        "Remove all the values."
+        with self.lock:
+            self._entries.clear()
+            self.size = 0
+
+    def keys(self) -> list[KeyT]:
+        "Get a list of the keys from the least recently used one."
+        with self.lock:
+            return list(self._entries)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DependencyGraph:
+    """Thread-safe graph of the files each template uses, such as the ones used by ``self.extends`` and ``include``.
+
+    Attributes
+    ----------
+    lock : threading.RLock"""
+
+    def __init__(self):
+        self.lock = RLock()
+        self._dependencies: dict[str, set[str]] = {}
+        self._dependents: dict[str, set[str]] = {}
+
+    def add(self, path: str, dependency: str) -> None:
+        "Record that the template of ``path`` uses the file of ``dependency``."
+        if path == dependency:
+            return
+        with self.lock:
+            self._dependencies.setdefault(path, set()).add(dependency)
+            self._dependents.setdefault(dependency, set()).add(path)
+
+    def get_dependencies(self, path: str) -> set[str]:
+        "Get the paths of the files the template of ``path`` uses directly."
+        with self.lock:
+            return set(self._dependencies.get(path, ()))
+
+    def get_dependents(self, path: str) -> set[str]:
+        "Get the paths of all the templates which use the file of ``path`` directly or indirectly."
+        with self.lock:
+            found: set[str] = set()
+            stack = [path]
+            while stack:
+                for dependent in self._dependents.get(stack.pop(), ()):
+                    if dependent not in found and dependent != path:
+                        found.add(dependent)
+                        stack.append(dependent)
+            return found
+
+    def remove(self, path: str) -> None:
+        "Forget the files the template of ``path`` uses. They are recorded again when it is rendered."
+        with self.lock:
+            for dependency in self._dependencies.pop(path, ()):
+                dependents = self._dependents.get(dependency)
+                if dependents is not None:
+                    dependents.discard(path)
+                    if not dependents:
+                        del self._dependents[dependency]
+
+    def clear(self) -> None:
+        "Forget all the files."
+        with self.lock:
+            self._dependencies.clear()
+            self._dependents.clear()
+
+    def __contains__(self, path: object) -> bool:
+        return path in self._dependencies or path in self._dependents
+
+
+def _add_note(error, note):
+    # エラーにメモを追加する。
+    if hasattr(error, "add_note"):
+        error.add_note(note)
+        return
+    # Python 3.10には`add_note`が無いので、3.11以降と同じ`__notes__`に入れる。
+    error.__notes__ = [*getattr(error, "__notes__", ()), note]
+
+
+def _is_binary(fp):
+    # テキストのファイルかバイナリのファイルかを判断する。わからない場合はモードを見る。
+    if isinstance(fp, TextIOBase):
+        return False
+    if isinstance(fp, (RawIOBase, BufferedIOBase, StreamWriter)):
+        return True
+    return "b" in getattr(fp, "mode", "")
+
+
+def _join_buffer(buffer, binary, encoding):
+    # 溜めた文字列を連結して空にする。
+    data = "".join(buffer)
+    buffer.clear()
+    return data.encode(encoding) if binary else data
+
+
+def _iterate_chunks(value, escape=None):
+    # ブロックの値を分割する。イテレータやリストなどはその中身を一つずつ渡す。
+    if isinstance(value, str):
+        yield value if escape is None else escape(value)
+    elif isinstance(value, (Iterator, list, tuple)):
+        for item in value:
+            yield from _iterate_chunks(item, escape)
+    else:
+        yield str(value) if escape is None else escape(value)
+
+
+async def _aiterate_chunks(value, escape=None):
+    # `_iterate_chunks`の非同期版で、非同期イテレータの中身も渡す。
+    if isinstance(value, str):
+        yield value if escape is None else escape(value)
+    elif isinstance(value, AsyncIterator):
+        async for item in value:
+            async for chunk in _aiterate_chunks(item, escape):
+                yield chunk
+    elif isinstance(value, (Iterator, list, tuple)):
+        for item in value:
+            async for chunk in _aiterate_chunks(item, escape):
+                yield chunk
+    else:
+        yield str(value) if escape is None else escape(value)